@@ -0,0 +1,622 @@
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import collections
+import shutil
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import importlib
+import contextlib
+import multiprocessing
+
+from dacite import from_dict
+
+from core import User, UserSession, LazyBlocks, Transaction, Payment, Reward, Block, Blockchain, BlockCheck, ProofOfWork, PowVerifier
+from miner import Miner, MinerBackend
+from store import BlockStore
+from codec import Codec
+from wire import Wire
+from gossip import Gossip
+import primes
+import factor
+
+
+BENCH_PASSWD = 'bench'
+
+
+def timeit(act, repeat, number=1):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            act()
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def mine(block, backend=MinerBackend.MINER_BACKEND_SYMPY):
+    # silence miner progress
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(Miner(backend, block=block).work())
+    return block
+
+
+def make_block(h_diff, solver='bench', prev=None, backend=MinerBackend.MINER_BACKEND_SYMPY):
+    return mine(Block(h_diff=h_diff, prev=prev, trans={}, pow=ProofOfWork(solver), hash=None), backend)
+
+
+def make_payments(chain, usrs, count, rng):
+    # senders are picked among users with coins, amounts never exceed balance
+    trans = []
+    for _ in range(count):
+        rich = [u for u in usrs if chain.get_bal(u.pub) >= 1]
+        if not rich:
+            break
+
+        src, dst = rng.choice(rich), rng.choice(usrs)
+        t = Transaction(from_adr=src.pub, to_adr=dst.pub, act=Payment(1), hash=None, sign=None)
+        t.dict_sign(src, BENCH_PASSWD)
+        trans.append(t)
+    return trans
+
+
+def make_chain(blocks, trans, users, h_diff, seed, work=0):
+    # synthetic history, work is not mined so only the tip block is checked, fake work only adds size
+    Blockchain.H_DIFF_INIT = h_diff
+    rng = random.Random(seed)
+
+    usrs = [User.create(BENCH_PASSWD) for _ in range(users)]
+    chain = Blockchain(ver='0.1', blocks={}, hash=None)
+
+    for i in range(blocks):
+        prev = chain.last_block()
+        block = chain.new_block(usrs[i % users].pub)
+
+        if prev is not None:
+            reward = Transaction(from_adr=None, to_adr=prev.pow.solver, act=Reward(chain.reward(), prev.dict_hash()), hash=None, sign=None)
+            block.add_trans(reward)
+
+        for t in make_payments(chain, usrs, trans, rng):
+            block.add_trans(t)
+        for _ in range(work):
+            num = rng.getrandbits(8 * h_diff)
+            block.pow.add_pow(str(num), {str(num): 1})
+        block.hash = block.dict_hash()
+        chain.import_block(block.dict_hash(), block)
+
+    return chain, usrs, rng
+
+
+def bench_pow_verify(args):
+    for h_diff in args.h_diff:
+        block = make_block(h_diff)
+
+        serial = timeit(block.work_check, args.repeat)
+        print(f'h_diff {h_diff} (v_diff {block.v_diff}): serial {serial:.4f}s')
+
+        for workers in args.workers:
+            verifier = PowVerifier(workers)
+            verifier.check(block.pow)  # warm up pool
+
+            t = timeit(lambda: block.work_check(verifier), args.repeat)
+            print(f'h_diff {h_diff} (v_diff {block.v_diff}): {workers} workers {t:.4f}s, x{serial / t:.2f}')
+            verifier.close()
+
+
+def _timed_factorint(backend, num):
+    start = time.perf_counter()
+    factors = MinerBackend.BACKENDS[backend](num)
+    return time.perf_counter() - start, factors
+
+
+def bench_factor(args):
+    rng = random.Random(args.seed)
+
+    for h_diff in range(args.h_diff_from, args.h_diff_to + 1, args.h_diff_step):
+        nums = [rng.getrandbits(8 * h_diff) for _ in range(args.samples)]
+        results = {}
+
+        for backend in args.backends:
+            total, timeouts, factors = 0, 0, []
+
+            # separate process per number so hard ones can be dropped on timeout
+            for num in nums:
+                with multiprocessing.Pool(1) as pool:
+                    try:
+                        t, f = pool.apply_async(_timed_factorint, (backend, num)).get(args.timeout)
+                        total += t
+                        factors.append(f)
+                    except multiprocessing.TimeoutError:
+                        timeouts += 1
+                        factors.append(None)
+
+            results[backend] = factors
+            print(f'h_diff {h_diff}: {backend} {total:.4f}s, {timeouts}/{len(nums)} timeouts')
+
+        # every backend must agree on solved numbers
+        for solved in zip(*results.values()):
+            solved = [f for f in solved if f is not None]
+            if any(f != solved[0] for f in solved):
+                print(f'h_diff {h_diff}: backends mismatch {solved}')
+
+
+def bench_race(args):
+    rng = random.Random(args.seed)
+    print(f'{os.cpu_count()} cores')
+
+    for h_diff in args.h_diff:
+        nums = [rng.getrandbits(8 * h_diff) for _ in range(args.samples)]
+        base = None
+
+        for workers in args.workers:
+            racer = factor.Racer(workers)
+            racer.factorint((1 << 127) - 1)  # start pool
+
+            start = time.perf_counter()
+            res = [racer.factorint(n) for n in nums]
+            t = time.perf_counter() - start
+            racer.close()
+
+            base = base or (t, res)
+            mark = '' if res == base[1] else ', factors mismatch'
+            print(f'h_diff {h_diff}: {workers} workers {t:.4f}s, x{base[0] / t:.2f}{mark}')
+
+
+def bench_suite(args):
+    results = {}
+
+    def record(name, t):
+        results[name] = t
+        print(f'{name}: {t:.6f}s')
+
+    chain, usrs, rng = make_chain(args.blocks, args.trans, args.users, args.h_diff, args.seed)
+    print(f'chain: {chain.blocks_count()} blocks, {args.trans} transactions per block, h_diff {args.h_diff}')
+
+    # mined tip on top of synthetic chain
+    tip = chain.new_block(usrs[0].pub)
+    for t in make_payments(chain, usrs, args.trans, rng):
+        tip.add_trans(t)
+    tip_dict = json.loads(json.dumps(mine(tip).to_dict()))
+
+    def cold_hash():
+        tip.invalidate()
+        tip.dict_hash()
+
+    record('dict_hash', timeit(cold_hash, args.repeat, args.number))
+    record('extract', timeit(lambda: tip.pow.extract(tip.v_diff - 1), args.repeat, args.number))
+
+    for backend in args.backends:
+        record(f'miner_work.{backend}', timeit(lambda: mine(chain.new_block(usrs[0].pub), backend), args.mine_repeat))
+
+    record('work_check', timeit(tip.work_check, args.repeat))
+
+    # freshly decoded block with cold signature cache, as received from peer
+    fresh = iter([from_dict(Block, tip_dict) for _ in range(args.repeat)])
+
+    def check_block():
+        User.VERIFY_CACHE.clear()
+        assert chain.check_block(next(fresh)) is BlockCheck.OK
+
+    record('check_block', timeit(check_block, args.repeat))
+
+    adrs = [u.pub for u in usrs]
+    trans_hashes = [h for b in chain.blocks.values() for h in b.trans]
+    record('get_bal', timeit(lambda: chain.get_bal(rng.choice(adrs)), args.repeat, args.number))
+    if trans_hashes:
+        record('get_trans', timeit(lambda: chain.get_trans(rng.choice(trans_hashes)), args.repeat, args.number))
+
+    # disk paths through cli, module name has a dash
+    cli = importlib.import_module('pico-cli')
+    tmp = tempfile.mkdtemp(prefix='pico-bench-')
+    try:
+        chain_path = os.path.join(tmp, 'blockchain.json')
+        record('dict_to_disk', timeit(lambda: asyncio.run(cli.CLI._dict_to_disk(chain, chain_path)), args.repeat))
+
+        store = BlockStore(os.path.join(tmp, 'blocks'))
+        for h, b in chain.blocks.items():
+            store.append(h, b.to_dict())
+        store.close()
+
+        def chain_init():
+            c = cli.CLI()
+            c.chain_init(os.path.join(tmp, 'missing.json'), os.path.join(tmp, 'blocks'))
+            c.store.close()
+
+        record('chain_init', timeit(chain_init, args.repeat))
+    finally:
+        shutil.rmtree(tmp)
+
+    if args.out:
+        meta = {k: v for k, v in vars(args).items() if k not in ('act', 'out', 'bench')}
+        meta['python'] = sys.version.split()[0]
+        with open(args.out, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=4)
+        print(f'Results saved to {args.out}.')
+
+
+def _peak(act):
+    tracemalloc.start()
+    try:
+        act()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_startup(args):
+    chain, usrs, _ = make_chain(args.blocks, args.trans, args.users, args.h_diff, args.seed, args.work)
+    adr = usrs[0].pub
+
+    cli = importlib.import_module('pico-cli')
+    tmp = tempfile.mkdtemp(prefix='pico-bench-')
+    try:
+        path = os.path.join(tmp, 'blocks')
+        store = BlockStore(path, binary=not args.json)
+        for h, b in chain.blocks.items():
+            store.append(h, b.to_dict())
+        store.close()
+        print(f'store: {len(chain.blocks)} blocks, {sum(os.path.getsize(os.path.join(path, n)) for n in os.listdir(path)) / 1024:.0f}KiB')
+
+        def eager():
+            # every block built up front, as before lazy loading
+            s = BlockStore(path)
+            Blockchain(ver='0.1', blocks={h: from_dict(Block, b) for h, b in s.items()}, hash=None).get_bal(adr)
+            s.close()
+
+        def lazy(verify=False):
+            c = cli.CLI()
+            c.chain_init(os.path.join(tmp, 'missing.json'), path, verify)
+            c.chain.get_bal(adr)
+            c.store.close()
+
+        def first_access():
+            s = BlockStore(path)
+            LazyBlocks(s)[s.get_hash(0)]
+            s.close()
+
+        runs = {'eager': eager, 'lazy': lazy, 'lazy_verify': lambda: lazy(True), 'first_access': first_access}
+        for name, act in runs.items():
+            t = timeit(act, args.repeat)
+            print(f'{name}: {t:.4f}s, peak {_peak(act) / 1024 / 1024:.1f}MiB')
+    finally:
+        shutil.rmtree(tmp)
+
+
+# strong pseudoprimes to many bases, carmichael numbers and mr64 edge cases
+HARD_COMPOSITES = (
+    2047, 3277, 4033, 4681, 8321, 561, 1105, 1729, 2465, 2821, 6601, 8911, 3215031751,
+    3825123056546413051, 318665857834031151167461, 3317044064679887385961981,
+    1050535501, 350269456337, 55245642489451, 7999252175582851, 585226005592931977,
+    (1 << 64) - 1, (1 << 64) + 1, 18446744073709551557 * 18446744073709551533
+)
+
+
+def _primes_corpus(size, rng):
+    corpus = list(HARD_COMPOSITES) + list(range(-2, 1 << 10))
+    p_small = [n for n in range(3, 1 << 16, 2) if primes.is_prime(n)]
+
+    for _ in range(size):
+        bits = rng.choice((16, 20, 21, 32, 48, 63, 64, 65, 80, 128, 256, 512))
+        n = rng.getrandbits(bits) | 1
+        corpus += [n, n + 2 * rng.getrandbits(8)]
+
+        # semiprimes, prime squares and chernick carmichael candidates
+        a, b = rng.choice(p_small), rng.getrandbits(bits) | 1
+        k = rng.getrandbits(bits // 3 or 1)
+        corpus += [a * b, a * a, (6 * k + 1) * (12 * k + 1) * (18 * k + 1)]
+    return corpus
+
+
+def _work_primes(args):
+    if args.store:
+        store = BlockStore(args.store)
+        blocks = [b for _, b in store.items()]
+        store.close()
+    else:
+        # sympy caches its factorizations, primality of their factors would be a cache hit
+        blocks = [make_block(args.h_diff, backend=MinerBackend.MINER_BACKEND_PICO).to_dict() for _ in range(args.blocks)]
+    return [[int(p) for factors in b['pow']['work'].values() for p in factors] for b in blocks]
+
+
+def bench_primes(args):
+    from sympy.ntheory import isprime
+
+    rng = random.Random(args.seed)
+    corpus = _primes_corpus(args.corpus, rng)
+    mismatch = [n for n in corpus if primes.is_prime(n) != isprime(n)]
+    print(f'corpus: {len(corpus)} numbers, {len(mismatch)} disagree with sympy {mismatch[0:10]}')
+
+    blocks = _work_primes(args)
+    count = sum(map(len, blocks))
+    large = sum(p > primes.SIEVE_LIMIT for b in blocks for p in b)
+    print(f'work: {len(blocks)} blocks, {count} factors, {large} above sieve limit')
+
+    def engine_cold():
+        for b in blocks:
+            primes.MEMO.clear()
+            all(primes.is_prime(p) for p in b)
+
+    def engine_warm():
+        # block checked again, as for every confirm
+        total = 0
+        for b in blocks:
+            all(primes.is_prime(p) for p in b)
+            start = time.perf_counter()
+            all(primes.is_prime(p) for p in b)
+            total += time.perf_counter() - start
+        return total
+
+    t_sympy = timeit(lambda: [all(isprime(p) for p in b) for b in blocks], args.repeat)
+    t_cold = timeit(engine_cold, args.repeat)
+    t_warm = min(engine_warm() for _ in range(args.repeat))
+    print(f'sympy {t_sympy:.4f}s, engine {t_cold:.4f}s x{t_sympy / t_cold:.1f}, block checked again {t_warm:.4f}s x{t_sympy / t_warm:.1f}')
+    print(f'engine paths: {primes.STATS}')
+    exit(1 if mismatch else 0)
+
+
+def bench_sign(args):
+    usr = User.create(BENCH_PASSWD)
+    session = UserSession(usr, BENCH_PASSWD)
+
+    def payments():
+        return [Transaction(from_adr=usr.pub, to_adr=usr.pub, act=Payment(i + 1), hash=None, sign=None) for i in range(args.trans)]
+
+    # password path decrypts and parses the key for every transaction
+    signed = []
+    for name, act in (
+        ('password', lambda ts: [t.dict_sign(usr, BENCH_PASSWD) for t in ts]),
+        ('session', lambda ts: [t.dict_sign(session) for t in ts]),
+        ('session batch', session.sign_batch),
+    ):
+        ts = payments()
+        t = timeit(lambda: act(ts), args.repeat)
+        signed += ts
+        print(f'{name}: {args.trans / t:.0f} signatures/s')
+
+    bad = sum(not t.dict_verify(usr.pub)[1] for t in signed)
+    session.wipe()
+    print(f'{bad} invalid signatures')
+    exit(1 if bad else 0)
+
+
+def _topology(nodes, degree, rng):
+    # random symmetric links, every node has at least degree peers
+    peers = [set() for _ in range(nodes)]
+    for node in range(nodes):
+        while len(peers[node]) < min(degree, nodes - 1):
+            other = rng.randrange(nodes)
+            if other != node:
+                peers[node].add(other)
+                peers[other].add(node)
+    return [sorted(p) for p in peers]
+
+
+def _gossip_flood(sizes, peers):
+    # every copy is checked, relayed to all peers and confirms again until block is in chain
+    confirms, accepted = [0] * len(peers), set()
+    queue, sent = collections.deque(), 0
+
+    def relay(node):
+        nonlocal sent
+        queue.extend(peers[node])
+        sent += len(peers[node]) * sizes['block']
+
+    relay(0)
+    confirms[0] = 1
+    while queue:
+        node = queue.popleft()
+        if node in accepted:
+            continue
+
+        relay(node)
+        confirms[node] += 1
+        if confirms[node] >= Blockchain.BLOCK_REQUIRED_CONFIRMS:
+            accepted.add(node)
+    return sent, len(accepted)
+
+
+def _gossip_inv(block, sizes, peers):
+    # same steps as CoreServer handlers, one confirm per peer
+    h = block.dict_hash()
+    gossips = [Gossip() for _ in peers]
+    confirmed = [set() for _ in peers]
+    queue, sent = collections.deque(), 0
+
+    def send(src, dst, data):
+        nonlocal sent
+        queue.append((src, dst, data))
+        sent += sizes[next(iter(data))]
+
+    def relay(node):
+        for peer in peers[node]:
+            send(node, peer, Gossip.inv('block', [h]))
+
+    gossips[0].offer('block', h, block)
+    confirmed[0].add(None)
+    relay(0)
+
+    while queue:
+        src, dst, data = queue.popleft()
+        g = gossips[dst]
+
+        if 'inv' in data:
+            if g.get('block', h) is not None:
+                confirmed[dst].add(src)
+            req = g.wanted(data['inv'], src)
+            if req is not None:
+                send(dst, src, req)
+        elif 'get_data' in data:
+            for _ in g.get_data(data["get_data"]):
+                send(dst, src, {'block': block})
+        elif g.offer('block', h, block):
+            relay(dst)
+            confirmed[dst] |= g.take_announcers(h) | {src}
+        else:
+            confirmed[dst].add(src)
+
+    required = [max(1, min(Blockchain.BLOCK_REQUIRED_CONFIRMS, len(p))) for p in peers]
+    return sent, sum(len(c) >= r for c, r in zip(confirmed, required))
+
+
+def bench_gossip(args):
+    # wire bytes for one block reaching every node, full block flooding vs inv/get_data
+    block = make_block(args.h_diff, backend=MinerBackend.MINER_BACKEND_PICO)
+    h = block.dict_hash()
+
+    sizes = {
+        'block': len(Wire.encode({'block': block.to_dict()}, True)),
+        'inv': len(Wire.encode(Gossip.inv('block', [h]), True)),
+        'get_data': len(Wire.encode({'get_data': {'block': [h]}}, True))
+    }
+    print(f'frames: block {sizes["block"]} B, inv {sizes["inv"]} B, get_data {sizes["get_data"]} B')
+
+    rng = random.Random(args.seed)
+    for nodes in args.nodes:
+        peers = _topology(nodes, args.degree, rng)
+
+        flood, flood_ok = _gossip_flood(sizes, peers)
+        inv, inv_ok = _gossip_inv(block, sizes, peers)
+        print(f'{nodes} nodes, {args.degree} peers: flood {flood / 1024:.1f} KiB ({flood_ok} accepted), inv {inv / 1024:.1f} KiB ({inv_ok} accepted), x{flood / inv:.1f} less')
+
+
+def bench_codec(args):
+    if args.store:
+        store = BlockStore(args.store)
+        blocks = [b for _, b in store.items()]
+        store.close()
+    else:
+        blocks = [json.loads(json.dumps(make_block(args.h_diff).to_dict())) for _ in range(args.blocks)]
+
+    forms = {
+        'json': (lambda b: json.dumps(b).encode(), json.loads),
+        'bin': (lambda b: Codec.encode(Codec.put_block, b), lambda p: Codec.decode(Codec.get_block, p))
+    }
+
+    for name, (enc, dec) in forms.items():
+        payloads = [enc(b) for b in blocks]
+        zipped = [zlib.compress(p) for p in payloads]
+
+        size, zsize = sum(map(len, payloads)), sum(map(len, zipped))
+        t_enc = timeit(lambda: [zlib.compress(enc(b)) for b in blocks], args.repeat) / len(blocks)
+        t_dec = timeit(lambda: [dec(zlib.decompress(z)) for z in zipped], args.repeat) / len(blocks)
+
+        print(f'{name}: {size / len(blocks):.0f} bytes/block, zlib {zsize / len(blocks):.0f}, encode {t_enc * 1000:.2f}ms, decode {t_dec * 1000:.2f}ms')
+
+
+def bench_compare(args):
+    with open(args.base) as f:
+        base = json.load(f)['results']
+    with open(args.new) as f:
+        new = json.load(f)['results']
+
+    regressions = 0
+    for name in sorted(set(base) & set(new)):
+        ratio = new[name] / base[name] if base[name] else float('inf')
+
+        mark = ''
+        if ratio > 1 + args.threshold:
+            mark = ' REGRESSION'
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            mark = ' improved'
+
+        print(f'{name}: {base[name]:.6f}s -> {new[name]:.6f}s, x{ratio:.2f}{mark}')
+
+    for name in sorted(set(base) ^ set(new)):
+        print(f'{name}: only in {args.base if name in base else args.new}')
+
+    print(f'{regressions} regressions, threshold {args.threshold:.0%}.')
+    exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python3 bench.py', description='PicoCoin benchmarks.')
+    parser.add_argument('--repeat', type=int, default=3, help='repeats per measurement, best is taken (default: 3)')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    pow_verify = sub.add_parser('pow-verify', help='serial vs parallel proof of work verification')
+    pow_verify.add_argument('--h-diff', type=int, nargs='+', default=[8, 11, 14], help='horizontal difficulties')
+    pow_verify.add_argument('--workers', type=int, nargs='+', default=[2, 4], help='parallel workers counts')
+    pow_verify.set_defaults(act=bench_pow_verify)
+
+    fact = sub.add_parser('factor', help='factorization backends on random h_diff sized numbers')
+    # racing backend needs its own processes, see race
+    serial = [b for b in MinerBackend.BACKENDS if b != MinerBackend.MINER_BACKEND_RACE]
+    fact.add_argument('--backends', type=str, nargs='+', default=serial, choices=serial, help='backends to compare')
+    fact.add_argument('--h-diff-from', type=int, default=14, help='first horizontal difficulty (default: 14)')
+    fact.add_argument('--h-diff-to', type=int, default=64, help='last horizontal difficulty (default: 64)')
+    fact.add_argument('--h-diff-step', type=int, default=2, help='horizontal difficulty step (default: 2)')
+    fact.add_argument('--samples', type=int, default=10, help='numbers per horizontal difficulty (default: 10)')
+    fact.add_argument('--timeout', type=float, default=60, help='seconds per number before it counts as timeout (default: 60)')
+    fact.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    fact.set_defaults(act=bench_factor)
+
+    race = sub.add_parser('race', help='racing factorization scaling from 1 to N workers')
+    race.add_argument('--h-diff', type=int, nargs='+', default=[10, 12, 14], help='horizontal difficulties (default: 10 12 14)')
+    race.add_argument('--workers', type=int, nargs='+', default=list(range(1, os.cpu_count() + 1)), help='workers counts, first is the base (default: 1 to cores count)')
+    race.add_argument('--samples', type=int, default=10, help='numbers per horizontal difficulty (default: 10)')
+    race.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    race.set_defaults(act=bench_race)
+
+    suite = sub.add_parser('suite', help='hot paths on synthetic chain, no network needed')
+    suite.add_argument('--blocks', type=int, default=100, help='synthetic chain blocks (default: 100)')
+    suite.add_argument('--trans', type=int, default=10, help='payments per block (default: 10)')
+    suite.add_argument('--users', type=int, default=8, help='synthetic users (default: 8)')
+    suite.add_argument('--h-diff', type=int, default=8, help='chain horizontal difficulty (default: 8)')
+    suite.add_argument('--backends', type=str, nargs='+', default=list(MinerBackend.BACKENDS), help='mining backends to time')
+    suite.add_argument('--number', type=int, default=100, help='calls per measurement for fast paths (default: 100)')
+    suite.add_argument('--mine-repeat', type=int, default=1, help='mined blocks per backend (default: 1)')
+    suite.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    suite.add_argument('--out', type=str, metavar='path', help='save results as json')
+    suite.set_defaults(act=bench_suite)
+
+    startup = sub.add_parser('startup', help='eager vs lazy chain loading from block store, balance query included')
+    startup.add_argument('--blocks', type=int, default=200, help='synthetic chain blocks (default: 200)')
+    startup.add_argument('--trans', type=int, default=10, help='payments per block (default: 10)')
+    startup.add_argument('--users', type=int, default=8, help='synthetic users (default: 8)')
+    startup.add_argument('--work', type=int, default=1024, help='fake work entries per block, sets record size (default: 1024)')
+    startup.add_argument('--h-diff', type=int, default=8, help='chain horizontal difficulty (default: 8)')
+    startup.add_argument('--json', action='store_true', help='store records as json instead of binary')
+    startup.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    startup.set_defaults(act=bench_startup)
+
+    prim = sub.add_parser('primes', help='primality engine vs sympy, agreement on random corpus and speed on block work factors')
+    prim.add_argument('--corpus', type=int, default=20000, help='random corpus rounds, 5 numbers each (default: 20000)')
+    prim.add_argument('--store', type=str, metavar='path', help='take work factors from block store instead of mining')
+    prim.add_argument('--blocks', type=int, default=3, help='mined blocks (default: 3)')
+    prim.add_argument('--h-diff', type=int, default=8, help='mined blocks horizontal difficulty (default: 8)')
+    prim.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    prim.set_defaults(act=bench_primes)
+
+    sign = sub.add_parser('sign', help='transaction signing with password per transaction vs unlocked session')
+    sign.add_argument('--trans', type=int, default=200, help='transactions signed per measurement (default: 200)')
+    sign.set_defaults(act=bench_sign)
+
+    gossip = sub.add_parser('gossip', help='bytes sent per block propagated, full block flooding vs inv/get_data on simulated network')
+    gossip.add_argument('--nodes', type=int, nargs='+', default=[8, 32, 128], help='network sizes (default: 8 32 128)')
+    gossip.add_argument('--degree', type=int, default=8, help='peers per node (default: 8)')
+    gossip.add_argument('--h-diff', type=int, default=8, help='mined block horizontal difficulty (default: 8)')
+    gossip.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    gossip.set_defaults(act=bench_gossip)
+
+    codec = sub.add_parser('codec', help='json vs binary block size and encode/decode time')
+    codec.add_argument('--store', type=str, metavar='path', help='take blocks from block store instead of mining')
+    codec.add_argument('--blocks', type=int, default=3, help='mined blocks (default: 3)')
+    codec.add_argument('--h-diff', type=int, default=8, help='mined blocks horizontal difficulty (default: 8)')
+    codec.set_defaults(act=bench_codec)
+
+    compare = sub.add_parser('compare', help='compare two suite results and flag regressions')
+    compare.add_argument('base', type=str, help='baseline results json')
+    compare.add_argument('new', type=str, help='new results json')
+    compare.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as regression (default: 0.1)')
+    compare.set_defaults(act=bench_compare)
+
+    args = parser.parse_args()
+    args.act(args)
@@ -0,0 +1,415 @@
+import socket
+import struct
+import base58
+
+from datetime import datetime as dt, timedelta
+
+
+class CodecError(Exception):
+    pass
+
+
+class CodecReader:
+    def __init__(self, data):
+        self.data = bytes(data)
+        self.pos = 0
+
+    def take(self, size):
+        if self.pos + size > len(self.data):
+            raise CodecError('truncated data')
+
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return chunk
+
+    def byte(self):
+        try:
+            b = self.data[self.pos]
+        except IndexError:
+            raise CodecError('truncated data')
+        self.pos += 1
+        return b
+
+    def uint(self):
+        # single byte values are the common case
+        b = self.byte()
+        if b < 0x80:
+            return b
+
+        num, shift = b & 0x7f, 7
+        for _ in range(Codec.VARINT_MAX):
+            b = self.byte()
+            num |= (b & 0x7f) << shift
+            if not b & 0x80:
+                return num
+            shift += 7
+        raise CodecError('varint too long')
+
+    def big(self):
+        return int.from_bytes(self.take(self.uint()), 'little')
+
+    def end(self):
+        if self.pos != len(self.data):
+            raise CodecError('trailing data')
+
+
+class Codec:
+    # payload: version | value, decoded value is equal to its json form so hashes stay the same
+    VER = 1
+    # 7 bits per byte, enough for 64 byte pow numbers
+    VARINT_MAX = 80
+    # work numbers are at most 64 bytes, factors of a valid one never multiply above it
+    WORK_BITS = 512
+
+    TAG_NONE = 0
+    TAG_RAW = 1
+    TAG_TEXT = 2
+
+    NUM_INT = 0
+    NUM_FLOAT = 1
+
+    ACT_KEYS = ('ivc', 'pay', 'msg', 'rew')
+    EPOCH = dt(1970, 1, 1)
+    FLOAT = struct.Struct('<d')
+
+    # primitives
+    @staticmethod
+    def put_uint(out, num):
+        if type(num) is not int or num < 0:
+            raise CodecError(f'not an unsigned int: {num!r}')
+
+        while num > 0x7f:
+            out.append((num & 0x7f) | 0x80)
+            num >>= 7
+        out.append(num)
+
+    @staticmethod
+    def put_big(out, num):
+        # length prefixed little-endian, decodes with one int.from_bytes
+        if type(num) is not int or num < 0:
+            raise CodecError(f'not an unsigned int: {num!r}')
+        Codec.put_bytes(out, num.to_bytes((num.bit_length() + 7) // 8, 'little'))
+
+    @staticmethod
+    def put_sint(out, num):
+        # zigzag, small negatives stay short
+        Codec.put_uint(out, 2 * num if num >= 0 else -2 * num - 1)
+
+    @staticmethod
+    def get_sint(reader):
+        z = reader.uint()
+        return z // 2 if not z & 1 else -(z + 1) // 2
+
+    @staticmethod
+    def put_bytes(out, raw):
+        Codec.put_uint(out, len(raw))
+        out += raw
+
+    @staticmethod
+    def get_bytes(reader):
+        return reader.take(reader.uint())
+
+    @staticmethod
+    def put_text(out, s):
+        if not isinstance(s, str):
+            raise CodecError(f'not a string: {s!r}')
+        Codec.put_bytes(out, s.encode())
+
+    @staticmethod
+    def get_text(reader):
+        try:
+            return Codec.get_bytes(reader).decode()
+        except UnicodeDecodeError as e:
+            raise CodecError(str(e))
+
+    @staticmethod
+    def put_num(out, num):
+        if type(num) is int:
+            out.append(Codec.NUM_INT)
+            Codec.put_sint(out, num)
+        elif type(num) is float:
+            out.append(Codec.NUM_FLOAT)
+            out += Codec.FLOAT.pack(num)
+        else:
+            raise CodecError(f'not a number: {num!r}')
+
+    @staticmethod
+    def get_num(reader):
+        tag = reader.byte()
+        if tag == Codec.NUM_INT:
+            return Codec.get_sint(reader)
+        if tag == Codec.NUM_FLOAT:
+            return Codec.FLOAT.unpack(reader.take(Codec.FLOAT.size))[0]
+        raise CodecError(f'unknown number tag {tag}')
+
+    # strings with compact raw form, text is kept when raw form does not give the same string back
+    @staticmethod
+    def _put_compact(out, s, to_raw, from_raw):
+        if s is None:
+            out.append(Codec.TAG_NONE)
+            return
+
+        try:
+            raw = to_raw(s)
+            if from_raw(raw) == s:
+                out.append(Codec.TAG_RAW)
+                Codec.put_bytes(out, raw)
+                return
+        except (ValueError, TypeError, OSError):
+            pass
+
+        out.append(Codec.TAG_TEXT)
+        Codec.put_text(out, s)
+
+    @staticmethod
+    def _get_compact(reader, from_raw):
+        tag = reader.byte()
+        if tag == Codec.TAG_NONE:
+            return None
+        if tag == Codec.TAG_RAW:
+            try:
+                return from_raw(Codec.get_bytes(reader))
+            except (ValueError, TypeError, OSError) as e:
+                raise CodecError(str(e))
+        if tag == Codec.TAG_TEXT:
+            return Codec.get_text(reader)
+        raise CodecError(f'unknown string tag {tag}')
+
+    @staticmethod
+    def put_hash(out, s):
+        Codec._put_compact(out, s, bytes.fromhex, bytes.hex)
+
+    @staticmethod
+    def get_hash(reader):
+        return Codec._get_compact(reader, bytes.hex)
+
+    @staticmethod
+    def _b58(raw):
+        return base58.b58encode(raw).decode()
+
+    @staticmethod
+    def put_b58(out, s):
+        # keys and signatures
+        Codec._put_compact(out, s, base58.b58decode, Codec._b58)
+
+    @staticmethod
+    def get_b58(reader):
+        return Codec._get_compact(reader, Codec._b58)
+
+    @staticmethod
+    def _time_to_raw(s):
+        micros = (dt.fromisoformat(s) - Codec.EPOCH) // timedelta(microseconds=1)
+        return micros.to_bytes(8, 'little', signed=True)
+
+    @staticmethod
+    def _time_from_raw(raw):
+        return str(Codec.EPOCH + timedelta(microseconds=int.from_bytes(raw, 'little', signed=True)))
+
+    @staticmethod
+    def put_time(out, s):
+        Codec._put_compact(out, s, Codec._time_to_raw, Codec._time_from_raw)
+
+    @staticmethod
+    def get_time(reader):
+        return Codec._get_compact(reader, Codec._time_from_raw)
+
+    @staticmethod
+    def _ipv6_from_raw(raw):
+        return socket.inet_ntop(socket.AF_INET6, raw)
+
+    @staticmethod
+    def put_ipv6(out, s):
+        Codec._put_compact(out, s, lambda a: socket.inet_pton(socket.AF_INET6, a), Codec._ipv6_from_raw)
+
+    @staticmethod
+    def get_ipv6(reader):
+        return Codec._get_compact(reader, Codec._ipv6_from_raw)
+
+    @staticmethod
+    def _int_key(s):
+        # work keys are decimal numbers, mined work keeps them as ints, json makes the same string of both
+        if type(s) is int and s >= 0:
+            return s
+
+        num = int(s) if isinstance(s, str) else -1
+        if num < 0 or str(num) != s:
+            raise CodecError(f'not a canonical number key: {s!r}')
+        return num
+
+    # objects
+    @staticmethod
+    def put_act(out, act):
+        if not isinstance(act, dict) or len(act) not in (1, 2):
+            raise CodecError(f'unknown action: {act!r}')
+
+        key = next(iter(act))
+        if key not in Codec.ACT_KEYS or list(act) not in ([key], ['rew', 'blk']):
+            raise CodecError(f'unknown action: {act!r}')
+
+        out.append(Codec.ACT_KEYS.index(key))
+        if key == 'msg':
+            Codec.put_text(out, act['msg'])
+        else:
+            Codec.put_num(out, act[key])
+
+        if key == 'rew':
+            Codec.put_hash(out, act['blk'])
+
+    @staticmethod
+    def get_act(reader):
+        tag = reader.byte()
+        if tag >= len(Codec.ACT_KEYS):
+            raise CodecError(f'unknown action tag {tag}')
+
+        key = Codec.ACT_KEYS[tag]
+        act = {key: Codec.get_text(reader) if key == 'msg' else Codec.get_num(reader)}
+        if key == 'rew':
+            act['blk'] = Codec.get_hash(reader)
+        return act
+
+    @staticmethod
+    def put_trans(out, trans):
+        Codec.put_hash(out, trans['hash'])
+        Codec.put_b58(out, trans['sign'])
+        Codec.put_time(out, trans['time'])
+        Codec.put_b58(out, trans['from_adr'])
+        Codec.put_b58(out, trans['to_adr'])
+        Codec.put_act(out, trans['act'])
+
+    @staticmethod
+    def get_trans(reader):
+        return {
+            'hash': Codec.get_hash(reader),
+            'sign': Codec.get_b58(reader),
+            'time': Codec.get_time(reader),
+            'from_adr': Codec.get_b58(reader),
+            'to_adr': Codec.get_b58(reader),
+            'act': Codec.get_act(reader)
+        }
+
+    @staticmethod
+    def put_pow(out, pow):
+        Codec.put_b58(out, pow['solver'])
+        Codec.put_uint(out, len(pow['work']))
+
+        for num, factors in pow['work'].items():
+            num = Codec._int_key(num)
+            Codec.put_uint(out, len(factors))
+
+            prod = 1
+            for prime, exp in factors.items():
+                prime = Codec._int_key(prime)
+                Codec.put_big(out, prime)
+                Codec.put_uint(out, exp)
+                prod *= prime ** exp
+
+            # valid work number is a product of its factors, it is sent only if not
+            if prod == num:
+                out.append(0)
+            else:
+                out.append(1)
+                Codec.put_big(out, num)
+
+    @staticmethod
+    def get_pow(reader):
+        solver = Codec.get_b58(reader)
+        work = {}
+
+        for _ in range(reader.uint()):
+            factors, prod = {}, 1
+            for _ in range(reader.uint()):
+                prime, exp = reader.big(), reader.uint()
+
+                # lower bound of the product is checked before multiplying, peer chosen exponents are unbounded
+                if exp > Codec.WORK_BITS or prod.bit_length() - 1 + (prime.bit_length() - 1) * exp > Codec.WORK_BITS:
+                    raise CodecError('work factors too large')
+
+                factors[str(prime)] = exp
+                prod *= prime ** exp
+
+            num = prod if not reader.byte() else reader.big()
+            if num.bit_length() > Codec.WORK_BITS:
+                raise CodecError('work number too large')
+            work[str(num)] = factors
+
+        return {'solver': solver, 'work': work}
+
+    @staticmethod
+    def put_block(out, block):
+        Codec.put_hash(out, block['hash'])
+        Codec.put_time(out, block['time'])
+        Codec.put_hash(out, block['prev'])
+        Codec.put_uint(out, block['h_diff'])
+        Codec.put_uint(out, block['v_diff'])
+
+        Codec.put_uint(out, len(block['trans']))
+        for trans_hash, trans in block['trans'].items():
+            Codec.put_hash(out, trans_hash)
+            Codec.put_trans(out, trans)
+
+        Codec.put_pow(out, block['pow'])
+
+    @staticmethod
+    def get_block_head(reader):
+        # everything but pow, pow work is the bulk of the record and is stored last
+        block = {
+            'hash': Codec.get_hash(reader),
+            'time': Codec.get_time(reader),
+            'prev': Codec.get_hash(reader),
+            'h_diff': reader.uint(),
+            'v_diff': reader.uint(),
+            'trans': {}
+        }
+
+        for _ in range(reader.uint()):
+            trans_hash = Codec.get_hash(reader)
+            block['trans'][trans_hash] = Codec.get_trans(reader)
+        return block
+
+    @staticmethod
+    def get_block(reader):
+        block = Codec.get_block_head(reader)
+        block['pow'] = Codec.get_pow(reader)
+        return block
+
+    @staticmethod
+    def put_peers(out, peers):
+        Codec.put_uint(out, len(peers))
+        for peer in peers:
+            Codec.put_ipv6(out, peer['ipv6'])
+            Codec.put_uint(out, peer['port'])
+
+    @staticmethod
+    def get_peers(reader):
+        return [{'ipv6': Codec.get_ipv6(reader), 'port': reader.uint()} for _ in range(reader.uint())]
+
+    @staticmethod
+    def put_blocks(out, blocks):
+        Codec.put_uint(out, len(blocks))
+        for block in blocks:
+            Codec.put_block(out, block)
+
+    @staticmethod
+    def get_blocks(reader):
+        return [Codec.get_block(reader) for _ in range(reader.uint())]
+
+    # versioned payloads
+    @staticmethod
+    def encode(put, value):
+        out = bytearray([Codec.VER])
+        try:
+            put(out, value)
+        except (KeyError, AttributeError, TypeError, ValueError) as e:
+            raise CodecError(f'unsupported value: {str(e)}')
+        return bytes(out)
+
+    @staticmethod
+    def decode(get, payload, whole=True):
+        reader = CodecReader(payload)
+        if reader.byte() != Codec.VER:
+            raise CodecError('unsupported codec version')
+
+        value = get(reader)
+        if whole:
+            reader.end()
+        return value
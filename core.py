@@ -1,12 +1,18 @@
+import os
+import time
 import zlib  # gzip 과 호환되는 압축 라이브러리
 import json  # json 형식을 읽고쓰게 해주는 라이브러리
 import base58  # 문자열을 base58 로 인코딩하는 라이브러리
 # 이 모듈은 BSD socket 인터페이스에 대한 액세스를 제공합니다. 모든 현대 유닉스 시스템, 윈도우, MacOS, 그리고 아마 추가 플랫폼에서 사용할 수 있습니다. 호출이 운영 체제 소켓 API로 이루어지기 때문에, 일부 동작은 플랫폼에 따라 다를 수 있습니다.
 import socket
+import threading
 import asyncio  # asyncio는 async/await 구문을 사용하여 동시성 코드를 작성하는 라이브러리입니다.
 import hashlib as hlib  # hash 알고리즘을 담고 있는 라이브러리
 
 from functools import reduce
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime as dt
 from typing import Union, Optional, Dict, List
 # typing 은 파이썬 변수에 타입 힌트를 줄 수 있다.
@@ -14,9 +20,13 @@ from typing import Union, Optional, Dict, List
 # Optional[str] 은 해당 변수가 str 또는 None 이라는것. Union[str, None]과 같다.
 from dataclasses import dataclass, asdict, field
 
+from wire import Wire, WireMsg, WireError
+from peers import PeerPool
+from metrics import METRICS
+from primes import is_prime
 from Crypto.Cipher import AES
-from sympy.ntheory import isprime
 from ecdsa import SigningKey, VerifyingKey, SECP256k1
+from ecdsa.ellipticcurve import PointJacobi
 
 
 # dataclass 데코레이터를 일반 클래스에 선언해주면 __init, __repr, __eq 이런 메서드를 자동으로 생성해줌.
@@ -24,14 +34,49 @@ from ecdsa import SigningKey, VerifyingKey, SECP256k1
 class DataHashable:
     hash: Optional[str]
 
+    # cached serialization hits/misses by cache key
+    HASH_STATS = {}
+
     def __post_init__(self):
-        self.hash = self.dict_hash()
+        # decoded objects keep the hash they came with, dict_verify checks it
+        self.hash = self.dict_hash() if self.hash is None else self.hash
         # 한줄짜리 if else 문 if self.hash is None else self.hash 은 아래와 같다.
         # if self.hash == None:
         #   self.hash = self.dict_hash()
         # else:
         #   self.hash = self.hash
 
+    def __setattr__(self, name, value):
+        # any field change except hash itself makes cached serialization stale
+        if name != 'hash' and name in self.__dataclass_fields__:
+            self.invalidate()
+        super().__setattr__(name, value)
+
+    def invalidate(self):
+        object.__setattr__(self, '_cache', {})
+
+    def _cached(self, key, make):
+        cache = vars(self).get('_cache')
+        if cache is None:
+            self.invalidate()
+            cache = self._cache
+
+        stats = DataHashable.HASH_STATS.setdefault(key, {'hit': 0, 'miss': 0})
+        if key in cache:
+            stats['hit'] += 1
+            return cache[key]
+
+        stats['miss'] += 1
+        cache[key] = make()
+        return cache[key]
+
+    @staticmethod
+    def hash_stats():
+        return {
+            k: dict(v, rate=v['hit'] / max(1, v['hit'] + v['miss']))
+            for k, v in DataHashable.HASH_STATS.items()
+        }
+
     def to_dict_without_hash(self):
         return {k: v for k, v in asdict(self).items() if k != 'hash'}
 
@@ -41,13 +86,14 @@ class DataHashable:
         self_dict['hash'] = self.hash
         return self_dict
 
+    def to_json_without_hash(self):
+        return self._cached('json', lambda: json.dumps(self.to_dict_without_hash()).encode())
+
     def dict_verify(self):
         return self.hash == self.dict_hash()
 
     def dict_hash(self):
-        self_dict = self.to_dict_without_hash()
-        self_json = json.dumps(self_dict).encode()
-        return hlib.sha3_256(self_json).hexdigest()
+        return self._cached('hash', lambda: hlib.sha3_256(self.to_json_without_hash()).hexdigest())
 
 
 @dataclass
@@ -63,17 +109,18 @@ class DataSignable(DataHashable):
         self_dict['hash'] = self.hash
         return self_dict
 
+    def to_json_without_sign(self):
+        return self._cached('json_sign', lambda: json.dumps(self.to_dict_without_sign()).encode())
+
     def dict_verify(self, pub):
         try:
-            self_dict = self.to_dict_without_sign()
-            User.verify(pub, json.dumps(self_dict).encode(), self.sign)
+            User.verify(pub, self.to_json_without_sign(), self.sign)
             return (super().dict_verify(), True)
         except Exception:
             return (super().dict_verify(), False)
 
-    def dict_sign(self, user, password):
-        self_dict = self.to_dict_without_sign()
-        self.sign = user.sign(json.dumps(self_dict).encode(), password)
+    def dict_sign(self, user, password=None):
+        self.sign = user.sign(self.to_json_without_sign(), password)
         self.hash = self.dict_hash()
         return self.sign
 
@@ -87,11 +134,68 @@ class DataTimestamp:
             self.time = str(dt.utcnow())
 
 
+class VerifyCache:
+    KEYS_MAX = 1024
+    SIGNS_MAX = 65536
+    # key uses before ecdsa precomputation pays off
+    HOT_USES = 4
+
+    def __init__(self, keys_max=None, signs_max=None):
+        self.keys_max = keys_max or VerifyCache.KEYS_MAX
+        self.signs_max = signs_max or VerifyCache.SIGNS_MAX
+        self.keys = OrderedDict()
+        self.signs = OrderedDict()
+        self.stats = {k: {'hit': 0, 'miss': 0} for k in ('keys', 'signs')}
+
+    @staticmethod
+    def _lru_put(cache, key, value, limit):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > limit:
+            cache.popitem(last=False)
+
+    def get_key(self, pub):
+        entry = self.keys.get(pub)
+        if entry is None:
+            self.stats['keys']['miss'] += 1
+            entry = [VerifyingKey.from_string(base58.b58decode(pub), curve=SECP256k1), 0]
+        else:
+            self.stats['keys']['hit'] += 1
+
+        entry[1] += 1
+        if entry[1] == VerifyCache.HOT_USES:
+            # decoded points carry no order, ecdsa needs it for precomputed tables
+            p = entry[0].pubkey.point
+            point = PointJacobi(p.curve(), p.x(), p.y(), 1, SECP256k1.order, generator=True)
+            entry[0] = VerifyingKey.from_public_point(point, curve=SECP256k1)
+
+        VerifyCache._lru_put(self.keys, pub, entry, self.keys_max)
+        return entry[0]
+
+    def is_verified(self, pub, h, sign):
+        if (pub, h, sign) in self.signs:
+            self.stats['signs']['hit'] += 1
+            self.signs.move_to_end((pub, h, sign))
+            return True
+
+        self.stats['signs']['miss'] += 1
+        return False
+
+    def add_verified(self, pub, h, sign):
+        VerifyCache._lru_put(self.signs, (pub, h, sign), True, self.signs_max)
+
+    def clear(self):
+        self.keys.clear()
+        self.signs.clear()
+
+
 @dataclass
 class User(DataHashable):
     priv: str
     pub: str
 
+    VERIFY_CACHE = VerifyCache()
+
     @staticmethod
     def _encrypt_priv(priv, password):
         h = hlib.sha3_256(password.encode())
@@ -142,27 +246,91 @@ class User(DataHashable):
     def verify(pub, msg, sign):
         h = hlib.sha3_256(msg).digest()
 
-        pub = VerifyingKey.from_string(base58.b58decode(pub), curve=SECP256k1)
-        pub.verify(base58.b58decode(sign), h)
+        cache = User.VERIFY_CACHE
+        if cache.is_verified(pub, h, sign):
+            return
+
+        cache.get_key(pub).verify(base58.b58decode(sign), h)
+        cache.add_verified(pub, h, sign)
+
+
+class SessionError(Exception):
+    pass
+
+
+class UserSession:
+    # decrypted signing key kept for ttl seconds, password is asked once per session
+    TTL = 300
+
+    def __init__(self, user, password, ttl=None):
+        self.pub = user.pub
+        self.ttl = UserSession.TTL if ttl is None else ttl
+
+        priv = User._decrypt_priv(user.priv, password)
+        self.key = SigningKey.from_string(base58.b58decode(priv), curve=SECP256k1)
+        self.expires = time.monotonic() + self.ttl
+
+        # key is wiped on time even if session is never used again
+        self.timer = threading.Timer(self.ttl, self.wipe)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def is_open(self):
+        if self.key is not None and time.monotonic() >= self.expires:
+            self.wipe()
+        return self.key is not None
+
+    def wipe(self):
+        self.key = None
+        self.timer.cancel()
+
+    def _key(self):
+        if not self.is_open():
+            raise SessionError('session expired')
+        return self.key
+
+    @staticmethod
+    def _sign(key, msg):
+        return base58.b58encode(key.sign(hlib.sha3_256(msg).digest())).decode()
+
+    def sign(self, msg, password=None):
+        # same call as User.sign, dict_sign takes a session instead of user
+        return UserSession._sign(self._key(), msg)
+
+    def sign_batch(self, items):
+        # key is taken once, expiry never cuts a batch halfway
+        key = self._key()
+        for item in items:
+            item.sign = UserSession._sign(key, item.to_json_without_sign())
+            item.hash = item.dict_hash()
+        return [item.sign for item in items]
 
 
 @dataclass
 class Invoice:
+    __slots__ = ('ivc',)
+
     ivc: float
 
 
 @dataclass
 class Payment:
+    __slots__ = ('pay',)
+
     pay: float
 
 
 @dataclass
 class Message:
+    __slots__ = ('msg',)
+
     msg: str
 
 
 @dataclass
 class Reward:
+    __slots__ = ('rew', 'blk')
+
     rew: float
     blk: str
 
@@ -173,10 +341,22 @@ class Transaction(DataTimestamp, DataSignable):
     to_adr: str
     act: Union[Invoice, Payment, Reward, Message]
 
+    ACTS = {'ivc': Invoice, 'pay': Payment, 'msg': Message, 'rew': Reward}
+
     def __post_init__(self):
         super(Transaction, self).__post_init__()
         super(DataTimestamp, self).__post_init__()
 
+    @staticmethod
+    def load(trans_dict):
+        # trusted local records only, dacite type checks are skipped
+        act = trans_dict['act']
+        trans = Transaction(
+            from_adr=trans_dict['from_adr'], to_adr=trans_dict['to_adr'],
+            act=Transaction.ACTS[next(iter(act))](**act), hash=trans_dict['hash'], sign=trans_dict['sign'])
+        trans.time = trans_dict['time']
+        return trans
+
 
 @dataclass
 class ProofOfWork:
@@ -195,24 +375,155 @@ class ProofOfWork:
 
     def add_pow(self, num, factors):
         self.work[num] = factors
+        if self.block is not None:
+            self.block.invalidate()
 
-    def extract(self, i):
-        data = self.block.to_dict_without_hash()
-        data['pow']['work'] = {n: f for n, f in list(self.work.items())[0:i]}
+    @staticmethod
+    def check_factors(num, factors):
+        # peer data, malformed keys and exponents above the number size fail instead of raising
+        try:
+            bits, prod = num.bit_length(), 1
+            for prime, exp in factors.items():
+                prime = int(prime)
+                if type(exp) is not int or not 0 < exp <= bits or prime < 2:
+                    return False
+
+                # running product stops at the number, peer keys may be huge, as in codec get_pow
+                if (prime.bit_length() - 1) * exp >= bits:
+                    return False
+                prod *= prime ** exp
+                if prod > num:
+                    return False
+
+            # primality only for factors the number bounds
+            return prod == num and all(is_prime(int(v)) for v in factors.keys())
+        except (ValueError, TypeError, AttributeError):
+            return False
 
-        h = hlib.sha3_256(json.dumps(data).encode()).digest()
-        return int.from_bytes(h[0:self.block.h_diff], byteorder='little')
+    @staticmethod
+    def check_data_range(data, work, start, stop, h_diff):
+        if len(work) < stop:
+            return False
+
+        tmpl = PowTemplate(data, h_diff)
+        for num, factors in work[0:start]:
+            tmpl.push(num, factors)
+
+        for i in range(start, stop):
+            num, factors = work[i]
+            if not ProofOfWork.check_factors(tmpl.extract(), factors):
+                return False
+            tmpl.push(num, factors)
+        return True
+
+    def template(self, count=None):
+        tmpl = PowTemplate(self.block.to_dict_without_hash(), self.block.h_diff)
+        for num, factors in list(self.work.items())[0:count]:
+            tmpl.push(num, factors)
+        return tmpl
+
+    def extract(self, i):
+        return self.template(i).extract()
 
     def work_check_h(self, i):
-        num = self.extract(i)
         factors = list(self.work.items())[i][1]
+        return self.check_factors(self.extract(i), factors)
 
-        # check factors are primes
-        are_primes = all(isprime(int(v)) for v in factors.keys())
-        return are_primes and (num == self.defact(factors))
+    def work_check(self, verifier=None):
+        if verifier is not None:
+            return verifier.check(self)
+
+        data = self.block.to_dict_without_hash()
+        return self.check_data_range(data, list(self.work.items()), 0, self.block.v_diff, self.block.h_diff)
+
+
+class PowTemplate:
+    # block json is serialized once, work entries are appended to a running hash
+    WORK_MARK = '\x00work\x00'
+
+    def __init__(self, data, h_diff):
+        data = dict(data)
+        data['pow'] = dict(data['pow'], work=PowTemplate.WORK_MARK)
+
+        # work is the last key of the last field, messages may carry the mark too
+        head, tail = json.dumps(data).rsplit(json.dumps(PowTemplate.WORK_MARK), 1)
+
+        self.h_diff = h_diff
+        self.count = 0
+        self.state = hlib.sha3_256((head + '{').encode())
+        self.tail = ('}' + tail).encode()
+
+    def push(self, num, factors):
+        entry = json.dumps({num: factors})[1:-1]
+        self.state.update(((', ' if self.count else '') + entry).encode())
+        self.count += 1
+
+    def extract(self):
+        h = self.state.copy()
+        h.update(self.tail)
+        return int.from_bytes(h.digest()[0:self.h_diff], byteorder='little')
+
+
+class PowVerifier:
+    def __init__(self, workers=None, chunk=None):
+        self.workers = workers or os.cpu_count()
+        # work entries per task, by default one task per worker so block is pickled once for each
+        self.chunk = chunk
+        self.pool = None
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def _tasks(self, pow):
+        data = pow.block.to_dict_without_hash()
+        work = list(pow.work.items())
+        v_diff, h_diff = pow.block.v_diff, pow.block.h_diff
+
+        # task needs work only up to its last entry
+        chunk = self.chunk or -(-v_diff // self.workers)
+        return [(data, work[0:min(i + chunk, v_diff)], i, min(i + chunk, v_diff), h_diff) for i in range(0, v_diff, chunk)]
+
+    def check(self, pow):
+        tasks = self._tasks(pow)
+        if self.workers <= 1:
+            return all(ProofOfWork.check_data_range(*task) for task in tasks)
+
+        pool = self._get_pool()
+        pending = {pool.submit(ProofOfWork.check_data_range, *task) for task in tasks}
+
+        # cancel not started chunks on first failure
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if not all(f.result() for f in done):
+                for f in pending:
+                    f.cancel()
+                return False
+        return True
 
-    def work_check(self):
-        return all(self.work_check_h(i) for i in range(self.block.v_diff))
+    async def check_async(self, pow):
+        # awaited on the loop, which keeps serving while workers check
+        if self.workers <= 1:
+            return await asyncio.get_running_loop().run_in_executor(None, self.check, pow)
+
+        pool = self._get_pool()
+        pending = {asyncio.wrap_future(pool.submit(ProofOfWork.check_data_range, *task)) for task in self._tasks(pow)}
+
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if not all(f.result() for f in done):
+                    return False
+            return True
+        finally:
+            for f in pending:
+                f.cancel()
 
 
 @dataclass
@@ -234,14 +545,213 @@ class Block(DataTimestamp, DataHashable):
 
     def add_trans(self, trans):
         self.trans[trans.dict_hash()] = trans
+        self.invalidate()
         self.hash = self.dict_hash()
 
     def add_pow(self, num, factors):
         self.pow.add_pow(num, factors)
         self.hash = self.dict_hash()
 
-    def work_check(self):
-        return self.pow.work_check()
+    def work_check(self, verifier=None):
+        return self.pow.work_check(verifier)
+
+    @staticmethod
+    def load(block_dict):
+        # trusted local records only, work dict is taken as is
+        trans = {h: Transaction.load(t) for h, t in block_dict['trans'].items()}
+        pow = ProofOfWork(block_dict['pow']['solver'], block_dict['pow']['work'])
+
+        block = Block(prev=block_dict['prev'], h_diff=block_dict['h_diff'], trans=trans, pow=pow, hash=block_dict['hash'])
+        block.time = block_dict['time']
+        block.v_diff = block_dict['v_diff']
+        return block
+
+
+class LazyBlocks(MutableMapping):
+    # blocks backed by block store, a record is decoded on first access
+    CACHE_MAX = 64
+
+    def __init__(self, store, verify=False, cache_max=None):
+        self.store = store
+        self.verify = verify
+        self.cache_max = cache_max or LazyBlocks.CACHE_MAX
+        self.cache = OrderedDict()
+        # imported blocks not yet appended to store
+        self.pending = {}
+
+    def _flush_pending(self):
+        for h in [h for h in self.pending if h in self.store]:
+            del self.pending[h]
+
+    def _materialize(self, block_hash):
+        block = Block.load(self.store.get(block_hash))
+        if self.verify and not block.dict_verify():
+            raise ValueError(f'block {block_hash[0:12]} in store has invalid hash')
+        return block
+
+    def __getitem__(self, block_hash):
+        block = self.pending.get(block_hash)
+        if block is not None:
+            return block
+
+        block = self.cache.get(block_hash)
+        if block is not None:
+            self.cache.move_to_end(block_hash)
+            return block
+
+        if block_hash not in self.store:
+            raise KeyError(block_hash)
+
+        block = self._materialize(block_hash)
+        self._cache_put(block_hash, block)
+        return block
+
+    def _cache_put(self, block_hash, block):
+        self.cache[block_hash] = block
+        self.cache.move_to_end(block_hash)
+        if len(self.cache) > self.cache_max:
+            self.cache.popitem(last=False)
+
+    def __setitem__(self, block_hash, block):
+        if block_hash in self.store:
+            self._cache_put(block_hash, block)
+        else:
+            self.pending[block_hash] = block
+
+    def __delitem__(self, block_hash):
+        raise TypeError('blocks cannot be removed from store')
+
+    def __contains__(self, block_hash):
+        return block_hash in self.pending or block_hash in self.store
+
+    def __len__(self):
+        self._flush_pending()
+        return len(self.store) + len(self.pending)
+
+    def __iter__(self):
+        self._flush_pending()
+        yield from list(self.store.heights)
+        yield from list(self.pending)
+
+    def heads(self):
+        # blocks with empty pow for indexing only, nothing is kept
+        for block_hash, head in self.store.heads():
+            yield block_hash, Block.load(dict(head, pow={'solver': None, 'work': {}}))
+
+    def verify_all(self):
+        return [h for h in self.store.heights if not Block.load(self.store.get(h)).dict_verify()]
+
+    def to_dicts(self):
+        self._flush_pending()
+        blocks = {h: b for h, b in self.store.items()}
+        blocks.update({h: b.to_dict() for h, b in self.pending.items()})
+        return blocks
+
+
+class Ledger:
+    def __init__(self):
+        self.bals = {}
+        self.hist = {}
+
+    def _add_hist(self, adr, trans_hash):
+        if self.hist.get(adr) is None:
+            self.hist[adr] = []
+        self.hist[adr].append(trans_hash)
+
+    def _add_bal(self, adr, amount):
+        self.bals[adr] = self.bals.get(adr, 0) + amount
+
+    def add_trans(self, trans_hash, trans):
+        if isinstance(trans.act, Payment):
+            self._add_bal(trans.to_adr, trans.act.pay)
+            self._add_bal(trans.from_adr, -trans.act.pay)
+        elif isinstance(trans.act, Reward):
+            self._add_bal(trans.to_adr, trans.act.rew)
+
+        for adr in {trans.from_adr, trans.to_adr}:
+            if adr is not None:
+                self._add_hist(adr, trans_hash)
+
+    def add_block(self, block_trans):
+        for trans_hash, trans in block_trans.items():
+            self.add_trans(trans_hash, trans)
+
+    def get_bal(self, adr):
+        return self.bals.get(adr, 0)
+
+    def get_history(self, adr, page=0, size=10):
+        # newest first
+        hist = self.hist.get(adr, [])
+        end = max(0, len(hist) - page * size)
+        start = max(0, end - size)
+        return hist[start:end][::-1]
+
+    def history_count(self, adr):
+        return len(self.hist.get(adr, []))
+
+
+class TransIndex:
+    def __init__(self):
+        self.trans = {}
+        self.rewards = {}
+
+    def add_block(self, block_hash, block_trans):
+        for pos, (trans_hash, trans) in enumerate(block_trans.items()):
+            self.trans[trans_hash] = (block_hash, pos)
+
+            if isinstance(trans.act, Reward):
+                self.rewards[trans.act.blk] = trans_hash
+
+    def get_trans(self, trans_hash):
+        return self.trans.get(trans_hash)
+
+    def get_reward(self, block_hash):
+        return self.rewards.get(block_hash)
+
+
+class Topology:
+    def __init__(self):
+        self.tip = None
+        # height -> hash, hash -> height
+        self.hashes = []
+        self.heights = {}
+        # prev -> hashes of chain blocks on it
+        self.children = {}
+        # hash -> work of chain up to block
+        self.work = {}
+
+    @staticmethod
+    def block_work(block):
+        # factored bytes
+        return block.h_diff * block.v_diff
+
+    def add_block(self, block_hash, block):
+        height = self.heights[block.prev] + 1 if block.prev in self.heights else 0
+
+        self.heights[block_hash] = height
+        self.children.setdefault(block.prev, []).append(block_hash)
+        self.work[block_hash] = self.work.get(block.prev, 0) + Topology.block_work(block)
+
+        # chain blocks never share prev (already solved check), heaviest tip extends main branch
+        if self.tip is None or self.work[block_hash] > self.work[self.tip]:
+            self.tip = block_hash
+            del self.hashes[height:]
+            self.hashes.append(block_hash)
+
+    def get_height(self, block_hash):
+        return self.heights.get(block_hash)
+
+    def get_hash(self, height):
+        try:
+            return self.hashes[height]
+        except IndexError:
+            return None
+
+    def get_children(self, prev):
+        return self.children.get(prev, [])
+
+    def get_work(self, block_hash):
+        return self.work.get(block_hash, 0)
 
 
 class BlockCheck:
@@ -261,6 +771,8 @@ class TransCheck:
     IN_CHAIN = 'transaction already in blockchain'
     INSUFF_COINS = 'insufficient coins'
     REWARD_NOT_FOUND = 'reward block not found'
+    ALREADY_REWARDED = 'block already rewarded'
+    IN_MEMPOOL = 'transaction already in mempool'
 
 
 @dataclass
@@ -271,11 +783,37 @@ class Blockchain(DataHashable):
 
     H_DIFF_INIT = 14
     BLOCK_REQUIRED_CONFIRMS = 6
+    CANDIDATES_MAX = 64
 
     def __post_init__(self):
         self.coin = 'PicoCoin'
         self.blocks_cache = {}
-        super().__post_init__()
+        # peers each candidate block was confirmed by
+        self.confirmed_by = {}
+        # valid blocks still collecting confirms, newest last
+        self.candidates = OrderedDict()
+        self.verifier = None
+
+        self.ledger = Ledger()
+        self.trans_index = TransIndex()
+        self.topo = Topology()
+
+        # stream block heads, blocks are materialized on first access
+        blocks = self.blocks.heads() if isinstance(self.blocks, LazyBlocks) else self.blocks.items()
+        for block_hash, block in blocks:
+            self._index_block(block_hash, block)
+
+        # chain hash covers every block, it is computed on export only
+
+    def to_dict_without_hash(self):
+        if isinstance(self.blocks, LazyBlocks):
+            blocks = self.blocks.to_dicts()
+        else:
+            blocks = {h: b.to_dict() for h, b in self.blocks.items()}
+        return {'coin': self.coin, 'ver': self.ver, 'blocks': blocks}
+
+    def to_dict(self):
+        return {'hash': self.dict_hash(), **self.to_dict_without_hash()}
 
     def new_block(self, solver):
         prev = self.last_block()
@@ -284,6 +822,11 @@ class Blockchain(DataHashable):
 
         return Block(h_diff=h_diff, prev=prev_hash, trans={}, pow=ProofOfWork(solver), hash=None)
 
+    def _index_block(self, block_hash, block):
+        self.topo.add_block(block_hash, block)
+        self.ledger.add_block(block.trans)
+        self.trans_index.add_block(block_hash, block.trans)
+
     def add_trans(self, block, trans):
         h = trans.dict_hash()
 
@@ -296,8 +839,13 @@ class Blockchain(DataHashable):
         print(f'Transaction {h[0:12]} accepted.')
         return True
 
-    def add_block(self, block):
+    def add_block(self, block, src=None, required=None, work_checked=False):
         h = block.dict_hash()
+        required = required or Blockchain.BLOCK_REQUIRED_CONFIRMS
+
+        # one confirm per peer, echoes of the same block are not counted again
+        if src is not None and src in self.confirmed_by.get(h, ()):
+            return False
 
         if self.blocks_cache.get(block.prev) is None:
             self.blocks_cache[block.prev] = {}
@@ -305,29 +853,49 @@ class Blockchain(DataHashable):
         if self.blocks_cache[block.prev].get(h) is None:
             self.blocks_cache[block.prev][h] = 0
 
-        # reject block if check fails
-        reason = self.check_block(block)
+        # reject block if check fails, work of relayed blocks was checked once per hash
+        reason = self.check_block(block, work_checked)
         if reason is not BlockCheck.OK:
             print(f'Block {h[0:12]} rejected: {str(reason)}.')
             del self.blocks_cache[block.prev][h]
+            self.confirmed_by.pop(h, None)
+            self.candidates.pop(h, None)
             return False
 
+        self.candidates[h] = block
+        self.candidates.move_to_end(h)
+        if len(self.candidates) > Blockchain.CANDIDATES_MAX:
+            self.candidates.popitem(last=False)
+
         # confirm
         self.blocks_cache[block.prev][h] += 1
+        if src is not None:
+            self.confirmed_by.setdefault(h, set()).add(src)
         print(f'Block {h[0:12]} confirms: {self.blocks_cache[block.prev][h]}')
 
         # add block to blockchain if got required confirms
-        if self.blocks_cache[block.prev][h] >= Blockchain.BLOCK_REQUIRED_CONFIRMS:
-            self.blocks[h] = block
+        if self.blocks_cache[block.prev][h] >= required:
+            self.import_block(h, block)
             del self.blocks_cache[block.prev][h]
+            self.confirmed_by.pop(h, None)
+            self.candidates.pop(h, None)
 
             print(f'Block {h[0:12]} accepted to blockchain.')
             return True
         return False
 
+    def import_block(self, block_hash, block):
+        # block must pass check_block, synced history is not confirmed by peers
+        self.blocks[block_hash] = block
+        self.invalidate()
+        self._index_block(block_hash, block)
+
     def get_block(self, block_hash):
         return self.blocks.get(block_hash)
 
+    def get_candidate(self, block_hash):
+        return self.candidates.get(block_hash)
+
     def get_block_confirms(self, block):
         if (block is None) or (self.blocks_cache.get(block.prev) is None):
             return None
@@ -336,32 +904,31 @@ class Blockchain(DataHashable):
     def get_h_diff(self, block_prev):
         if block_prev is None:
             return Blockchain.H_DIFF_INIT
-        return block_prev.h_diff + int(self.blocks_count() % 10000 == 0)
+        # blocks count up to prev, not chain length, so side blocks get the same diff
+        count = self.topo.get_height(block_prev.hash) + 1
+        return block_prev.h_diff + int(count % 10000 == 0)
 
     def get_trans(self, trans_hash):
-        return [block.trans[trans_hash] for block in self.blocks.values() if block.trans.get(trans_hash)]
+        loc = self.trans_index.get_trans(trans_hash)
+        if loc is None:
+            return []
+        return [self.blocks[loc[0]].trans[trans_hash]]
+
+    def is_rewarded(self, block_hash):
+        return self.trans_index.get_reward(block_hash) is not None
 
     def get_bal(self, usr_pub):
-        def filt(trans):
-            if isinstance(trans.act, Payment):
-                if trans.to_adr == usr_pub:
-                    return trans.act.pay
-                elif trans.from_adr == usr_pub:
-                    return -trans.act.pay
-            elif isinstance(trans.act, Reward) and trans.to_adr == usr_pub:
-                return trans.act.rew
+        return self.ledger.get_bal(usr_pub)
 
-        return sum(filt(trans) for block in self.blocks.values() for trans in block.trans.values())
+    def get_history(self, usr_pub, page=0, size=10):
+        return self.ledger.get_history(usr_pub, page, size)
 
     def last_block(self):
-        try:
-            tmp = list(self.blocks.values())
-            return tmp[len(tmp) - 1]
-        except IndexError:
-            return None
+        tip = self.topo.tip
+        return self.blocks[tip] if tip is not None else None
 
     def blocks_count(self):
-        return len(self.blocks.keys())
+        return len(self.topo.hashes)
 
     def round(self):
         return self.blocks_count() // 10000
@@ -369,6 +936,13 @@ class Blockchain(DataHashable):
     def reward(self):
         return 2 ** (8 - 8 * self.round() / 50)
 
+    async def work_check_async(self, block):
+        # pow off the loop, chain state is then checked on it with work_checked
+        if self.verifier is not None:
+            return await self.verifier.check_async(block.pow)
+        return await asyncio.get_running_loop().run_in_executor(None, block.work_check)
+
+    @METRICS.timed('check_trans', 'trans_check')
     def check_trans(self, trans):
         # check hash and sign
         check_hash, check_sign = trans.dict_verify(trans.from_adr)
@@ -379,11 +953,11 @@ class Blockchain(DataHashable):
             return TransCheck.INVALID_SIGN
 
         # check transaction in blockchain
-        if self.get_trans(trans.dict_hash()):
+        if self.trans_index.get_trans(trans.dict_hash()):
             return TransCheck.IN_CHAIN
 
         # check billing balance
-        if isinstance(trans.act, Payment) and self.get_bal(trans.from_adr) < trans.act.amount:
+        if isinstance(trans.act, Payment) and self.get_bal(trans.from_adr) < trans.act.pay:
             return TransCheck.INSUFF_COINS
 
         # check reward
@@ -391,10 +965,13 @@ class Blockchain(DataHashable):
             prev = self.get_block(trans.act.blk)
             if (prev is None) or (prev.pow.solver != trans.to_adr):
                 return TransCheck.REWARD_NOT_FOUND
+            if self.is_rewarded(trans.act.blk):
+                return TransCheck.ALREADY_REWARDED
 
         return TransCheck.OK
 
-    def check_block(self, block):
+    @METRICS.timed('check_block', 'block_check')
+    def check_block(self, block, work_checked=False):
         # check hash
         if not block.dict_verify():
             return BlockCheck.INVALID_HASH
@@ -409,29 +986,47 @@ class Blockchain(DataHashable):
         if (block.h_diff != self.get_h_diff(prev)) or (block.h_diff < Blockchain.H_DIFF_INIT) or (block.v_diff != block.get_v_diff()):
             return BlockCheck.INVALID_DIFF
 
-        # check pow
-        if not block.work_check():
+        # check pow, callers that verified it off the loop skip it
+        if not work_checked and not block.work_check(self.verifier):
             return BlockCheck.POW_FAILED
 
         # check if block is in blockchain
-        if self.blocks.get(block.dict_hash()):
+        if block.dict_hash() in self.blocks:
             return BlockCheck.IN_CHAIN
 
         # check if block with previous hash is in blockchain
-        if any(b.prev == block.prev for b in self.blocks.values()):
+        if self.topo.get_children(block.prev):
             return BlockCheck.ALREADY_SOLVED
 
-        # check transactions
-        for trans in block.trans.values():
+        # check transactions, against chain and earlier ones of the same block
+        rewarded, spent = set(), {}
+        for trans_hash, trans in block.trans.items():
+            # index and ledger are keyed by block keys, an alias key would hide a replay
+            if trans_hash != trans.dict_hash():
+                return TransCheck.INVALID_HASH
+
             reason = self.check_trans(trans)
             if reason is not TransCheck.OK:
                 return reason
 
+            if isinstance(trans.act, Reward):
+                if trans.act.blk in rewarded:
+                    return TransCheck.ALREADY_REWARDED
+                rewarded.add(trans.act.blk)
+
+            # incoming payments of the block are not counted, as in mempool
+            if isinstance(trans.act, Payment):
+                spent[trans.from_adr] = spent.get(trans.from_adr, 0) + trans.act.pay
+                if self.get_bal(trans.from_adr) < spent[trans.from_adr]:
+                    return TransCheck.INSUFF_COINS
+
         return BlockCheck.OK
 
 
 @dataclass
 class Peer:
+    __slots__ = ('ipv6', 'port')
+
     ipv6: str
     port: int
 
@@ -444,18 +1039,20 @@ class Net(DataHashable):
     # 그래서 함수 field(default_factory=list)를 사용하면 기본값 []을 할당할 수 있음.
 
     def __post_init__(self):
-        self.ipv6 = self.get_ipv6()
+        self._ipv6 = None
         self.hlr = None
         self.serv = None
+        self.pool = PeerPool()
         super().__post_init__()
 
-    def serv_init(self, hlr):
-        self.serv = asyncio.start_server(
-            self.recv, '::0', 10000, family=socket.AF_INET6)
+    async def serv_init(self, hlr):
         self.hlr = hlr
+        self.serv = await asyncio.start_server(
+            self.recv, '::0', 10000, family=socket.AF_INET6)
 
     def add_peer(self, peer):
         self.peers.append(peer)
+        self.invalidate()
 
     def update_peer(self, peer):
         uniq = not any(p == peer for p in self.peers)
@@ -472,34 +1069,69 @@ class Net(DataHashable):
             sock.connect(('2001:4860:4860::8888', 80))
             return sock.getsockname()[0]
 
-    async def send(self, data_dict):
-        data_json = json.dumps(data_dict).encode()
-        data_comp = zlib.compress(data_json)
-
-        for peer in self.peers:
-            if peer.ipv6 == self.ipv6:
-                await asyncio.sleep(0)
-                continue
-
-            try:
-                _, writer = await asyncio.open_connection(peer.ipv6, peer.port, family=socket.AF_INET6)
-                writer.write(data_comp)
-                await writer.drain()
-                writer.close()
-            except (ConnectionError, TimeoutError, OSError):
-                await asyncio.sleep(0)
-                continue
-
-    async def recv(self, client, _):
-        data_comp = b''
-
-        while True:
-            tmp = await client.read(1024)
-            if not tmp:
-                break
-            data_comp += tmp
-
-        data_json = zlib.decompress(data_comp).decode()
-        data = json.loads(data_json)
-
-        await self.hlr(data)
+    @property
+    def ipv6(self):
+        # looked up once on first use, commands that never send do not need it
+        if self._ipv6 is None:
+            self._ipv6 = self.get_ipv6()
+        return self._ipv6
+
+    def peer_stats(self):
+        return self.pool.stats()
+
+    def get_peer(self, ipv6):
+        # peers listen on default port unless known otherwise
+        return next((p for p in self.peers if p.ipv6 == ipv6), None) or Peer(ipv6, 10000)
+
+    async def send(self, data_dict, peers=None, legacy=None):
+        msg = WireMsg(data_dict, legacy)
+
+        # all peers at once over pooled connections, each with own timeout
+        peers = [peer for peer in (self.peers if peers is None else peers) if peer.ipv6 != self.ipv6]
+        return await self.pool.broadcast(msg, peers)
+
+    async def send_many(self, data_dicts):
+        # bulk messages are streamed back to back, delivered count per peer
+        # own address only if already known, bulk senders skip the external lookup and may reach own node
+        msgs = [WireMsg(data_dict) for data_dict in data_dicts]
+        peers = [peer for peer in self.peers if peer.ipv6 != self._ipv6]
+        return peers, await self.pool.stream(msgs, peers)
+
+    async def recv(self, client, writer):
+        # sender address, confirms and get_data replies go by it
+        src = writer.get_extra_info('peername')[0]
+
+        try:
+            head = await client.readexactly(Wire.HEAD.size)
+
+            # old peers send one zlib message and close connection
+            if head[0] == Wire.LEGACY_MARK:
+                await self.hlr(await Wire.read_legacy(client, head), src)
+                return
+
+            # next frame is read only after handler is done, tcp pushes back on sender
+            caps = []
+            while True:
+                start = time.perf_counter()
+                data = await Wire.read(client, head)
+                METRICS.observe('net_recv_decode', time.perf_counter() - start)
+
+                # capabilities of the asking peer decide the format of replies
+                if 'hello' in data:
+                    caps = Wire.peer_caps(data)
+                    reply = Wire.hello()
+                else:
+                    reply = await self.hlr(data, src)
+
+                # requests are answered on the same connection, in order
+                if reply is not None:
+                    writer.write(Wire.encode(reply, Wire.CAP_BIN in caps))
+                    await writer.drain()
+
+                head = await client.readexactly(Wire.HEAD.size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except (WireError, ValueError, zlib.error) as e:
+            print(f'Message from peer dropped: {str(e)}.')
+        finally:
+            writer.close()
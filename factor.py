@@ -0,0 +1,490 @@
+import os
+import random
+import itertools
+import threading
+import multiprocessing
+
+from math import gcd, isqrt
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from primes import is_prime, primes_upto
+
+
+TRIAL_LIMIT = 1 << 16
+TRIAL_PRIMES = primes_upto(TRIAL_LIMIT)
+
+SQUFOF_LIMIT = 1 << 62
+SQUFOF_MULTS = (1, 3, 5, 7, 11, 15, 21, 33, 35, 55, 77, 105, 165, 231, 385, 1155)
+
+RHO_BATCH = 128
+
+RHO_STEPS = 1 << 14
+
+PM1_B1 = 20000
+PM1_B2 = 1000000
+
+# (B1, curves) escalation, roughly after GMP-ECM tables for 15..30 digit factors
+ECM_SCHEDULE = (
+    (2000, 25),
+    (11000, 90),
+    (50000, 300),
+    (250000, 700),
+)
+ECM_B2_MULT = 50
+
+_ecm_primes = {}
+
+
+class FactorCanceled(Exception):
+    pass
+
+
+def _iroot(n, k):
+    x = 1 << ((n.bit_length() + k - 1) // k)
+    while True:
+        y = ((k - 1) * x + n // x ** (k - 1)) // k
+        if y >= x:
+            return x
+        x = y
+
+
+def _perfect_power(n):
+    # factors below trial limit are already removed, so roots are large
+    for k in range(2, n.bit_length() // TRIAL_LIMIT.bit_length() + 2):
+        r = _iroot(n, k)
+        if r ** k == n:
+            return r, k
+    return n, 1
+
+
+def _trial(n, factors):
+    for p in TRIAL_PRIMES:
+        if p * p > n:
+            break
+
+        if n % p == 0:
+            e = 0
+            while n % p == 0:
+                n //= p
+                e += 1
+            factors[p] = e
+
+    # cofactor below limit squared is prime
+    if 1 < n < TRIAL_LIMIT * TRIAL_LIMIT:
+        factors[n] = factors.get(n, 0) + 1
+        n = 1
+    return n
+
+
+def _brent(n, c, y, limit):
+    m = RHO_BATCH
+    g, r, q = 1, 1, 1
+    x = ys = y
+    steps = 0
+
+    while g == 1:
+        x = y
+        for _ in range(r):
+            y = (y * y + c) % n
+
+        k = 0
+        while k < r and g == 1:
+            ys = y
+            for _ in range(min(m, r - k)):
+                y = (y * y + c) % n
+                q = q * abs(x - y) % n
+            g = gcd(q, n)
+            k += m
+
+        steps += r
+        r <<= 1
+        if steps > limit:
+            return None
+
+    # batch overshot, backtrack one step at a time
+    if g == n:
+        while True:
+            ys = (ys * ys + c) % n
+            g = gcd(abs(x - ys), n)
+            if g > 1:
+                break
+
+    return g if g != n else None
+
+
+def _squfof(n):
+    s = isqrt(n)
+    if s * s == n:
+        return s
+
+    for k in SQUFOF_MULTS:
+        kn = k * n
+        p0 = isqrt(kn)
+        q0 = kn - p0 * p0
+        if q0 == 0:
+            g = gcd(n, p0)
+            if 1 < g < n:
+                return g
+            continue
+
+        bound = 6 * isqrt(2 * isqrt(kn))
+        p_prev, q_prev, q = p0, 1, q0
+
+        # forward cycle until a square form
+        for i in range(2, bound):
+            b = (p0 + p_prev) // q
+            p = b * q - p_prev
+            q, q_prev = q_prev + b * (p_prev - p), q
+            p_prev = p
+
+            r = isqrt(q)
+            if not i & 1 and r * r == q:
+                break
+        else:
+            continue
+
+        # reverse cycle until p repeats
+        b = (p0 - p_prev) // r
+        p_prev = b * r + p_prev
+        q_prev = r
+        q = (kn - p_prev * p_prev) // q_prev
+
+        for _ in range(bound):
+            b = (p0 + p_prev) // q
+            p = b * q - p_prev
+            q, q_prev = q_prev + b * (p_prev - p), q
+            if p == p_prev:
+                break
+            p_prev = p
+
+        g = gcd(n, p_prev)
+        if 1 < g < n:
+            return g
+    return None
+
+
+def _pm1(n, primes):
+    # stage 1, a^(B1 smooth exponent)
+    a = 2
+    for p in primes:
+        if p > PM1_B1:
+            break
+        pe = p
+        while pe * p <= PM1_B1:
+            pe *= p
+        a = pow(a, pe, n)
+
+    g = gcd(a - 1, n)
+    if g != 1:
+        return g if g != n else None
+
+    # stage 2, one extra prime below B2 with cached prime gaps
+    gaps = {}
+    i = 0
+    while primes[i] <= PM1_B1:
+        i += 1
+    x = pow(a, primes[i], n)
+    acc = x - 1
+
+    for j in range(i + 1, len(primes)):
+        gap = primes[j] - primes[j - 1]
+        if gaps.get(gap) is None:
+            gaps[gap] = pow(a, gap, n)
+        x = x * gaps[gap] % n
+        acc = acc * (x - 1) % n
+
+        if not j & 1023:
+            g = gcd(acc, n)
+            if g != 1:
+                return g if g != n else None
+
+    g = gcd(acc, n)
+    return g if 1 < g < n else None
+
+
+def _ec_add(p, q, d, n):
+    u = (p[0] - p[1]) * (q[0] + q[1])
+    v = (p[0] + p[1]) * (q[0] - q[1])
+    a, s = u + v, u - v
+    return d[1] * a * a % n, d[0] * s * s % n
+
+
+def _ec_dbl(p, a24, n):
+    s = (p[0] + p[1]) ** 2
+    d = (p[0] - p[1]) ** 2
+    t = s - d
+    return s * d % n, t * (d + a24 * t) % n
+
+
+def _ec_mul(p, k, a24, n):
+    # montgomery ladder, add/dbl inlined as this is the ecm hot loop
+    xp, zp = p
+    x0, z0 = p
+    s, d = (x0 + z0) ** 2, (x0 - z0) ** 2
+    t = s - d
+    x1, z1 = s * d % n, t * (d + a24 * t) % n
+
+    for bit in bin(k)[3:]:
+        u = (x0 - z0) * (x1 + z1)
+        v = (x0 + z0) * (x1 - z1)
+        xa, za = zp * (u + v) ** 2 % n, xp * (u - v) ** 2 % n
+
+        if bit == '1':
+            s, d = (x1 + z1) ** 2, (x1 - z1) ** 2
+            t = s - d
+            x0, z0 = xa, za
+            x1, z1 = s * d % n, t * (d + a24 * t) % n
+        else:
+            s, d = (x0 + z0) ** 2, (x0 - z0) ** 2
+            t = s - d
+            x1, z1 = xa, za
+            x0, z0 = s * d % n, t * (d + a24 * t) % n
+    return x0, z0
+
+
+def _ecm_curve(n, b1, b2, primes, rng):
+    # suyama parametrization of a montgomery curve
+    sigma = rng.randrange(6, n - 1)
+    u = (sigma * sigma - 5) % n
+    v = 4 * sigma % n
+    x, z = pow(u, 3, n), pow(v, 3, n)
+
+    den = 16 * x * v % n
+    g = gcd(den, n)
+    if g != 1:
+        return g if g != n else None
+    a24 = pow(v - u, 3, n) * (3 * u + v) * pow(den, -1, n) % n
+
+    # stage 1
+    k = 1
+    for p in primes:
+        if p > b1:
+            break
+        pe = p
+        while pe * p <= b1:
+            pe *= p
+        k *= pe
+    q = _ec_mul((x, z), k, a24, n)
+
+    g = gcd(q[1], n)
+    if g != 1:
+        return g if g != n else None
+
+    # stage 2, baby steps of 2 * d * q
+    dd = 2 * isqrt(isqrt(b2)) + 2
+    steps = [_ec_dbl(q, a24, n)]
+    steps.append(_ec_dbl(steps[0], a24, n))
+    for i in range(2, dd):
+        steps.append(_ec_add(steps[i - 1], steps[0], steps[i - 2], n))
+    betas = [s[0] * s[1] % n for s in steps]
+
+    acc = 1
+    base = b1 - 1 if b1 & 1 else b1 - 2
+    r = _ec_mul(q, base, a24, n)
+    t = _ec_mul(q, base - 2 * dd, a24, n)
+    step = steps[-1]
+
+    pi = 0
+    while pi < len(primes) and primes[pi] <= base:
+        pi += 1
+
+    while base < b2:
+        alpha = r[0] * r[1] % n
+        while pi < len(primes) and primes[pi] <= base + 2 * dd:
+            delta = (primes[pi] - base) // 2 - 1
+            s = steps[delta]
+            acc = acc * ((r[0] - s[0]) * (r[1] + s[1]) - alpha + betas[delta]) % n
+            pi += 1
+        r, t = _ec_add(r, step, t, n), r
+        base += 2 * dd
+
+    g = gcd(acc, n)
+    return g if 1 < g < n else None
+
+
+def _ecm(n, rng, stop=None):
+    b1 = b2 = primes = None
+    for b1, curves in ECM_SCHEDULE:
+        b2 = ECM_B2_MULT * b1
+        if _ecm_primes.get(b2) is None:
+            _ecm_primes[b2] = primes_upto(b2)
+        primes = _ecm_primes[b2]
+
+        for _ in range(curves):
+            if stop is not None and stop():
+                return None
+            g = _ecm_curve(n, b1, b2, primes, rng)
+            if g:
+                return g
+
+    # keep going with the largest bounds
+    while stop is None or not stop():
+        g = _ecm_curve(n, b1, b2, primes, rng)
+        if g:
+            return g
+    return None
+
+
+def split(n, rng=None, stop=None, full=True):
+    # full split runs deterministic methods too, racing attempts differ in random ones only
+    rng = rng or random.Random(n)
+
+    if n & 1 == 0:
+        return 2
+
+    if full and n < SQUFOF_LIMIT:
+        g = _squfof(n)
+        if g:
+            return g
+
+    # rho finds factors up to ~2^28 cheaply, p-1 catches smooth p-1, ecm takes the rest
+    g = _brent(n, rng.randrange(1, n - 1), rng.randrange(0, n), RHO_STEPS)
+    if g:
+        return g
+
+    if full:
+        if _ecm_primes.get(PM1_B2) is None:
+            _ecm_primes[PM1_B2] = primes_upto(PM1_B2)
+        g = _pm1(n, _ecm_primes[PM1_B2])
+        if g:
+            return g
+    return _ecm(n, rng, stop)
+
+
+def factorint(n, splitter=split):
+    factors = {}
+    if n < 2:
+        return factors if n != 0 else {0: 1}
+
+    n = _trial(n, factors)
+
+    stack = [n]
+    while stack:
+        m = stack.pop()
+        if m == 1:
+            continue
+
+        if is_prime(m):
+            factors[m] = factors.get(m, 0) + 1
+            continue
+
+        r, k = _perfect_power(m)
+        if k > 1:
+            stack += [r] * k
+            continue
+
+        d = splitter(m)
+        stack += [d, m // d]
+
+    return dict(sorted(factors.items()))
+
+
+# racing workers state, set once per worker process
+_race_rounds = None
+
+
+def _race_init(race_rounds):
+    global _race_rounds
+    _race_rounds = race_rounds
+
+
+def _race_split(n, attempt, round_id):
+    # losers see their round slot cleared and give up at next curve
+    slot = round_id % len(_race_rounds)
+    stop = lambda: _race_rounds[slot] != round_id
+    return split(n, random.Random(f'{n}:{attempt}'), stop, full=(attempt == 0))
+
+
+class RaceCall:
+    def __init__(self):
+        self.canceled = False
+        self.round_id = None
+
+
+class Racer:
+    # cofactors below this are split locally faster than a pool round trip
+    RACE_LIMIT = 1 << 64
+    # splits running at once, each has its own slot watched by its workers
+    ROUND_SLOTS = 64
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.rounds = multiprocessing.RawArray('q', Racer.ROUND_SLOTS)
+        self.round_ids = itertools.count(1)
+        self.calls = set()
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_race_init, initargs=(self.rounds,))
+        return self.pool
+
+    def _stop_round(self, round_id):
+        slot = round_id % len(self.rounds)
+        if self.rounds[slot] == round_id:
+            self.rounds[slot] = 0
+
+    def close(self):
+        if self.pool is not None:
+            for slot in range(len(self.rounds)):
+                self.rounds[slot] = 0
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def cancel(self):
+        # stops factorizations running now, ones started later are not affected
+        with self.lock:
+            for call in self.calls:
+                call.canceled = True
+                if call.round_id is not None:
+                    self._stop_round(call.round_id)
+
+    def split(self, n, call):
+        if n < Racer.RACE_LIMIT or self.workers <= 1:
+            if call.canceled:
+                raise FactorCanceled()
+            return split(n)
+
+        with self.lock:
+            if call.canceled:
+                raise FactorCanceled()
+            round_id = next(self.round_ids)
+            self.rounds[round_id % len(self.rounds)] = round_id
+            call.round_id = round_id
+
+        pool = self._get_pool()
+        pending = {pool.submit(_race_split, n, i, round_id) for i in range(self.workers)}
+
+        try:
+            # first nontrivial split wins, canceled round leaves all attempts empty
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    if f.result():
+                        return f.result()
+            raise FactorCanceled()
+        finally:
+            with self.lock:
+                self._stop_round(round_id)
+                call.round_id = None
+            for f in pending:
+                f.cancel()
+
+    def factorint(self, n):
+        call = RaceCall()
+        with self.lock:
+            self.calls.add(call)
+
+        try:
+            return factorint(n, lambda m: self.split(m, call))
+        finally:
+            with self.lock:
+                self.calls.discard(call)
+
+
+RACER = Racer()
+
+
+def race_factorint(n):
+    return RACER.factorint(n)
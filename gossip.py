@@ -0,0 +1,146 @@
+import time
+
+from collections import OrderedDict
+
+
+class Gossip:
+    # hashes already relayed or fetched, oldest forgotten first
+    SEEN_MAX = 16384
+    # payloads kept for peers asking after our inv
+    DATA_MAX = 256
+    # hashes per inv and get_data
+    INV_MAX = 1024
+    # payload is asked from one announcer, from next one only after timeout
+    ASK_TIMEOUT = 10
+
+    KINDS = ('block', 'trans')
+
+    def __init__(self, seen_max=None, data_max=None):
+        self.seen_max = seen_max or Gossip.SEEN_MAX
+        self.data_max = data_max or Gossip.DATA_MAX
+
+        # hash -> false for payloads that failed for good, they are neither checked nor fetched again
+        self.seen = OrderedDict()
+        self.data = OrderedDict()
+        # hash -> [deadline, kind, peers asked]
+        self.asked = {}
+        # peers that announced a hash before its payload came, each is a confirm
+        self.announcers = OrderedDict()
+
+        self.stats = {'relayed': {k: 0 for k in Gossip.KINDS}, 'dups': 0, 'inv': 0, 'asked': 0, 'served': 0}
+
+    @staticmethod
+    def _lru_put(cache, key, value, limit):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > limit:
+            cache.popitem(last=False)
+
+    def is_seen(self, h):
+        return h in self.seen
+
+    def is_valid(self, h):
+        return self.seen.get(h) is True
+
+    def offer(self, kind, h, obj=None, check=None):
+        # true only for the first valid copy, later copies are not checked again, object is kept for get_data
+        if h in self.seen:
+            self.seen.move_to_end(h)
+            self.stats['dups'] += 1
+            return False
+
+        # check gives false for invalid for good, none for not valid yet
+        valid = check() if check is not None else True
+        if valid is False:
+            Gossip._lru_put(self.seen, h, False, self.seen_max)
+            self.asked.pop(h, None)
+        if not valid:
+            return False
+
+        Gossip._lru_put(self.seen, h, True, self.seen_max)
+        self.asked.pop(h, None)
+        if obj is not None:
+            Gossip._lru_put(self.data, h, (kind, obj), self.data_max)
+
+        self.stats['relayed'][kind] += 1
+        return True
+
+    def take_announcers(self, h):
+        return self.announcers.pop(h, set())
+
+    def get(self, kind, h):
+        entry = self.data.get(h)
+        return entry[1] if entry is not None and entry[0] == kind else None
+
+    @staticmethod
+    def inv(kind, hashes):
+        return {'inv': {kind: list(hashes)}}
+
+    @staticmethod
+    def hashes(req, kind):
+        hashes = req.get(kind, []) if isinstance(req, dict) else None
+        if not isinstance(hashes, list):
+            raise ValueError(f'bad {kind} hashes')
+        return [h for h in hashes[0:Gossip.INV_MAX] if isinstance(h, str)]
+
+    def wanted(self, inv, src):
+        # unseen hashes nobody was asked for recently, as get_data request or None
+        now = time.monotonic()
+        self.stats['inv'] += 1
+
+        want = {}
+        for kind in Gossip.KINDS:
+            for h in Gossip.hashes(inv, kind):
+                if h in self.seen:
+                    continue
+
+                srcs = self.announcers.get(h, set())
+                srcs.add(src)
+                Gossip._lru_put(self.announcers, h, srcs, self.seen_max)
+
+                entry = self.asked.get(h)
+                if entry is not None and entry[0] > now:
+                    continue
+
+                tried = entry[2] if entry is not None else set()
+                self.asked[h] = [now + Gossip.ASK_TIMEOUT, kind, tried | {src}]
+                want.setdefault(kind, []).append(h)
+
+        if len(self.asked) > self.seen_max:
+            self.asked = {h: e for h, e in self.asked.items() if e[0] > now}
+
+        self.stats['asked'] += sum(map(len, want.values()))
+        return {'get_data': want} if want else None
+
+    def retry(self):
+        # payloads not delivered in time are asked from next announcer, as (peer, get_data request) pairs
+        now = time.monotonic()
+        reqs = {}
+
+        for h, entry in list(self.asked.items()):
+            deadline, kind, tried = entry
+            if deadline > now:
+                continue
+
+            left = self.announcers.get(h, set()) - tried
+            if h in self.seen or not left:
+                # nobody else has it, next inv asks again
+                del self.asked[h]
+                continue
+
+            src = min(left)
+            entry[0] = now + Gossip.ASK_TIMEOUT
+            tried.add(src)
+            reqs.setdefault(src, {}).setdefault(kind, []).append(h)
+
+        self.stats['asked'] += sum(len(hashes) for req in reqs.values() for hashes in req.values())
+        return [(src, {'get_data': req}) for src, req in reqs.items()]
+
+    def get_data(self, req):
+        # payload messages for hashes still held, unknown ones are skipped
+        for kind in Gossip.KINDS:
+            for h in Gossip.hashes(req, kind):
+                obj = self.get(kind, h)
+                if obj is not None:
+                    self.stats['served'] += 1
+                    yield {kind: obj.to_dict()}
@@ -0,0 +1,133 @@
+import time
+
+from collections import OrderedDict
+
+from core import Payment, Reward, TransCheck
+
+
+class Mempool:
+    MAX_SIZE = 4096
+    MAX_AGE = 3600
+    # rewards sent before their block, unsigned so kept apart from everything else
+    ORPHANS_MAX = 64
+
+    def __init__(self, chain, max_size=None, max_age=None):
+        self.chain = chain
+        self.max_size = max_size or Mempool.MAX_SIZE
+        self.max_age = max_age or Mempool.MAX_AGE
+
+        # hash -> (transaction, arrival time), in arrival order
+        self.trans = OrderedDict()
+        self.orphans = OrderedDict()
+        self.reserved = {}
+        self.rewards = set()
+
+    def __len__(self):
+        return len(self.trans)
+
+    def __contains__(self, trans_hash):
+        return trans_hash in self.trans or trans_hash in self.orphans
+
+    def _reserve(self, trans, sign):
+        if isinstance(trans.act, Payment):
+            self.reserved[trans.from_adr] = self.reserved.get(trans.from_adr, 0) + sign * trans.act.pay
+            if not self.reserved[trans.from_adr]:
+                del self.reserved[trans.from_adr]
+        elif isinstance(trans.act, Reward):
+            if sign > 0:
+                self.rewards.add(trans.act.blk)
+            else:
+                self.rewards.discard(trans.act.blk)
+
+    def _is_orphan(self, reason, trans):
+        # reward for a block this node has not seen at all
+        blk = trans.act.blk if isinstance(trans.act, Reward) else None
+        return reason is TransCheck.REWARD_NOT_FOUND and self.chain.get_block(blk) is None and self.chain.get_candidate(blk) is None
+
+    def check(self, trans):
+        if trans.dict_hash() in self:
+            return TransCheck.IN_MEMPOOL
+
+        reason = self.chain.check_trans(trans)
+
+        # reward for a valid block still collecting confirms is checked again on block fill
+        if reason is TransCheck.REWARD_NOT_FOUND:
+            block = self.chain.get_candidate(trans.act.blk)
+            if block is not None and block.pow.solver == trans.to_adr:
+                reason = TransCheck.OK
+        if reason is not TransCheck.OK:
+            return reason
+
+        # double spends against pending transactions
+        if isinstance(trans.act, Payment):
+            if self.chain.get_bal(trans.from_adr) - self.reserved.get(trans.from_adr, 0) < trans.act.pay:
+                return TransCheck.INSUFF_COINS
+
+        if isinstance(trans.act, Reward) and trans.act.blk in self.rewards:
+            return TransCheck.ALREADY_REWARDED
+
+        return TransCheck.OK
+
+    def add(self, trans):
+        self.expire()
+
+        reason = self.check(trans)
+
+        # block not seen yet, reward waits aside and never pushes out signed transactions
+        if self._is_orphan(reason, trans):
+            self.orphans[trans.dict_hash()] = (trans, time.monotonic())
+            if len(self.orphans) > Mempool.ORPHANS_MAX:
+                self.orphans.popitem(last=False)
+            return TransCheck.OK
+
+        if reason is not TransCheck.OK:
+            return reason
+
+        # evict oldest when full
+        if len(self.trans) >= self.max_size:
+            self.remove(next(iter(self.trans)))
+
+        self.trans[trans.dict_hash()] = (trans, time.monotonic())
+        self._reserve(trans, 1)
+        return TransCheck.OK
+
+    def adopt(self):
+        # orphans whose block came join the pool if solver matches, the rest keep waiting
+        for trans_hash, (trans, _) in list(self.orphans.items()):
+            if self.chain.get_block(trans.act.blk) is None and self.chain.get_candidate(trans.act.blk) is None:
+                continue
+
+            del self.orphans[trans_hash]
+            self.add(trans)
+
+    def remove(self, trans_hash):
+        self.orphans.pop(trans_hash, None)
+        entry = self.trans.pop(trans_hash, None)
+        if entry is not None:
+            self._reserve(entry[0], -1)
+        return entry is not None
+
+    def remove_block(self, block):
+        for trans_hash in block.trans.keys():
+            self.remove(trans_hash)
+
+    def expire(self):
+        deadline = time.monotonic() - self.max_age
+        while self.trans:
+            trans_hash, (_, arrived) = next(iter(self.trans.items()))
+            if arrived > deadline:
+                break
+            self.remove(trans_hash)
+
+        while self.orphans:
+            trans_hash, (_, arrived) = next(iter(self.orphans.items()))
+            if arrived > deadline:
+                break
+            del self.orphans[trans_hash]
+
+    def select(self, limit=None):
+        self.adopt()
+
+        # same order on every node regardless of arrival
+        trans = sorted((t for t, _ in self.trans.values()), key=lambda t: (t.time, t.dict_hash()))
+        return trans[0:limit]
@@ -0,0 +1,130 @@
+import json
+import time
+import bisect
+import asyncio
+import cProfile
+import functools
+
+
+class Histogram:
+    # upper bounds in seconds, last bucket is everything above
+    BOUNDS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+    def __init__(self):
+        self.buckets = [0] * (len(Histogram.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(Histogram.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        bounds = [f'<={b}' for b in Histogram.BOUNDS] + [f'>{Histogram.BOUNDS[-1]}']
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'avg': self.total / self.count if self.count else 0,
+            'max': self.max,
+            'buckets': {b: n for b, n in zip(bounds, self.buckets) if n}
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.start = time.time()
+        self.hists = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value):
+        hist = self.hists.get(name)
+        if hist is None:
+            hist = self.hists[name] = Histogram()
+        hist.observe(value)
+
+    def count(self, name, key, inc=1):
+        counter = self.counters.setdefault(name, {})
+        counter[key] = counter.get(key, 0) + inc
+
+    def gauge(self, name, get):
+        # evaluated on snapshot only, costs nothing on hot paths
+        self.gauges[name] = get
+
+    def timed(self, name, counter=None):
+        def wrap(func):
+            @functools.wraps(func)
+            def timed_func(*args, **kwargs):
+                start = time.perf_counter()
+                res = func(*args, **kwargs)
+                self.observe(name, time.perf_counter() - start)
+
+                # check results, None means ok
+                if counter is not None:
+                    self.count(counter, 'ok' if res is None else str(res))
+                return res
+            return timed_func
+        return wrap
+
+    def snapshot(self):
+        gauges = {}
+        for name, get in self.gauges.items():
+            try:
+                gauges[name] = get()
+            except Exception as e:
+                gauges[name] = f'error: {str(e)}'
+
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.start,
+            'hists': {k: v.to_dict() for k, v in self.hists.items()},
+            'counters': self.counters,
+            'gauges': gauges
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4, default=str)
+
+    async def _http(self, reader, writer):
+        try:
+            # any request gets the snapshot, headers are skipped
+            while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                pass
+
+            body = self.to_json().encode()
+            head = f'HTTP/1.0 200 OK\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'
+            writer.write(head.encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve_http(self, port, host='127.0.0.1'):
+        return await asyncio.start_server(self._http, host, port)
+
+    async def dump_forever(self, path, every):
+        while True:
+            await asyncio.sleep(every)
+            with open(path, 'w') as f:
+                f.write(self.to_json())
+
+    @staticmethod
+    async def profile_forever(path, every, window):
+        # profile a short window every period, last window is kept in pstats format
+        while True:
+            await asyncio.sleep(max(0, every - window))
+
+            prof = cProfile.Profile()
+            prof.enable()
+            try:
+                await asyncio.sleep(window)
+            finally:
+                prof.disable()
+            prof.dump_stats(path)
+
+
+METRICS = Metrics()
@@ -1,35 +1,119 @@
-import asyncio
-from sympy.ntheory import factorint
-
-
-class MinerBackend:
-    MINER_BACKEND_SYMPY = 'sympy'
-
-    def __init__(self, backend):
-        self.backend = backend
-
-    async def factorint(self, num):
-        loop = asyncio.get_running_loop()
-
-        if self.backend == MinerBackend.MINER_BACKEND_SYMPY:
-            return await loop.run_in_executor(None, factorint, num)
-        raise NotImplementedError()
-
-
-class Miner:
-    def __init__(self, backend=MinerBackend.MINER_BACKEND_SYMPY, block=None):
-        self.set_block(block)
-        self.backend = MinerBackend(backend)
-
-    def set_block(self, block):
-        self.block = block
-
-    async def work(self):
-        for i in range(self.block.v_diff):
-            num = self.block.pow.extract(i)
-            factors = await self.backend.factorint(num)
-
-            self.block.add_pow(num, factors)
-            print(f'solved {i + 1}/{self.block.v_diff}')
-
-        return self.block.pow
+import time
+import asyncio
+from sympy.ntheory import factorint
+
+import factor
+from metrics import METRICS
+
+
+class MinerBackend:
+    MINER_BACKEND_SYMPY = 'sympy'
+    MINER_BACKEND_PICO = 'pico'
+    MINER_BACKEND_RACE = 'race'
+
+    BACKENDS = {
+        MINER_BACKEND_SYMPY: factorint,
+        MINER_BACKEND_PICO: factor.factorint,
+        MINER_BACKEND_RACE: factor.race_factorint
+    }
+
+    def __init__(self, backend, workers=None):
+        self.backend = backend
+
+        self.racer = None
+        if backend == MinerBackend.MINER_BACKEND_RACE:
+            self.racer = factor.Racer(workers) if workers else factor.RACER
+
+    async def factorint(self, num):
+        loop = asyncio.get_running_loop()
+
+        fact = self.racer.factorint if self.racer else MinerBackend.BACKENDS.get(self.backend)
+        if fact is None:
+            raise NotImplementedError()
+        return await loop.run_in_executor(None, fact, num)
+
+    def cancel(self):
+        # only racing workers can be stopped, other backends finish in background
+        if self.racer is not None:
+            self.racer.cancel()
+
+    def close(self):
+        if self.racer is not None:
+            self.racer.close()
+
+
+class Miner:
+    # seconds between partial work checkpoints
+    CHECKPOINT_EVERY = 30
+
+    def __init__(self, backend=MinerBackend.MINER_BACKEND_SYMPY, block=None, workers=None):
+        self.set_block(block)
+        self.backend = MinerBackend(backend, workers)
+        self.stop = None
+        self.stats = {'solved': 0, 'canceled': 0, 'discarded': 0, 'work_time': 0, 'discarded_time': 0}
+
+    def set_block(self, block):
+        self.block = block
+        self.block_time = 0
+
+    def cancel(self):
+        if self.stop is not None:
+            self.stop.set()
+
+    def close(self):
+        self.backend.close()
+
+    def discard(self):
+        # work on current block will never be rewarded
+        self.stats['discarded'] += 1
+        self.stats['discarded_time'] += self.block_time
+        return self.block_time
+
+    async def work(self, checkpoint=None):
+        self.stop = asyncio.Event()
+        stop = asyncio.ensure_future(self.stop.wait())
+
+        tmpl = self.block.pow.template()
+        saved = time.monotonic()
+
+        try:
+            for i in range(tmpl.count, self.block.v_diff):
+                start = time.monotonic()
+
+                num = tmpl.extract()
+                fact = asyncio.ensure_future(self.backend.factorint(num))
+                await asyncio.wait([fact, stop], return_when=asyncio.FIRST_COMPLETED)
+
+                elapsed = time.monotonic() - start
+                METRICS.observe('miner_iter', elapsed)
+                self.block_time += elapsed
+                self.stats['work_time'] += elapsed
+
+                # running factorization result is dropped
+                if not fact.done():
+                    self.backend.cancel()
+                    fact.add_done_callback(lambda f: f.cancelled() or f.exception())
+                    self.stats['canceled'] += 1
+                    return None
+
+                # racer stopped from outside, no solution for this block
+                try:
+                    factors = fact.result()
+                except factor.FactorCanceled:
+                    self.stats['canceled'] += 1
+                    return None
+
+                self.block.pow.add_pow(num, factors)
+                tmpl.push(num, factors)
+                print(f'solved {i + 1}/{self.block.v_diff}')
+
+                if checkpoint is not None and time.monotonic() - saved >= Miner.CHECKPOINT_EVERY:
+                    await checkpoint(self.block)
+                    saved = time.monotonic()
+        finally:
+            stop.cancel()
+            self.stop = None
+
+        self.stats['solved'] += 1
+        self.block.hash = self.block.dict_hash()
+        return self.block.pow
@@ -0,0 +1,192 @@
+import time
+import socket
+import asyncio
+
+from wire import Wire, WireError
+from metrics import METRICS
+
+
+class PeerConn:
+    QUEUE_MAX = 256
+    # queued messages written together, one drain per batch
+    BATCH_MAX = 64
+    TIMEOUT = 5
+    BACKOFF_MIN = 0.5
+    BACKOFF_MAX = 60
+
+    def __init__(self, ipv6, port, timeout=None, queue_max=None):
+        self.ipv6 = ipv6
+        self.port = port
+        self.timeout = timeout or PeerConn.TIMEOUT
+
+        self.queue = asyncio.Queue(maxsize=queue_max or PeerConn.QUEUE_MAX)
+        self.reader = None
+        self.writer = None
+        self.task = None
+        # negotiated on first connect, None until then
+        self.caps = None
+        # peer did not answer hello, it gets unframed json only
+        self.legacy = False
+
+        self.backoff = PeerConn.BACKOFF_MIN
+        self.retry_at = 0
+
+        self.stats = {'sent': 0, 'failed': 0, 'dropped': 0, 'reconnects': 0, 'lat_avg': None, 'lat_max': 0}
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.serve())
+
+    def put(self, msg):
+        fut = asyncio.get_running_loop().create_future()
+
+        # bounded queue, drop oldest message for a lagging peer
+        if self.queue.full():
+            _, old = self.queue.get_nowait()
+            old.set_result(False)
+            self.stats['dropped'] += 1
+
+        self.queue.put_nowait((msg, fut))
+        self.start()
+        return fut
+
+    async def put_wait(self, msg):
+        # bulk senders wait for room instead of dropping own messages
+        fut = asyncio.get_running_loop().create_future()
+        self.start()
+        await self.queue.put((msg, fut))
+        return fut
+
+    async def _connect(self):
+        conn = asyncio.open_connection(self.ipv6, self.port, family=socket.AF_INET6)
+        self.reader, self.writer = await asyncio.wait_for(conn, self.timeout)
+        self.stats['reconnects'] += 1
+
+        # peers without hello drop the connection, they get legacy json over new ones
+        if self.caps is None:
+            caps = await self._hello()
+            self.legacy = caps is None
+            self.caps = caps or []
+            if self.writer is None:
+                await self._connect()
+
+    async def _hello(self):
+        try:
+            self.writer.write(Wire.encode(Wire.hello()))
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+            return Wire.peer_caps(await asyncio.wait_for(Wire.read(self.reader), self.timeout))
+        except (ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, WireError, ValueError):
+            self.close()
+            return None
+
+    def _fail(self):
+        self.close()
+        self.stats['failed'] += 1
+        self.retry_at = time.monotonic() + self.backoff
+        self.backoff = min(PeerConn.BACKOFF_MAX, self.backoff * 2)
+
+    def _latency(self, lat):
+        METRICS.observe(f'net_send.[{self.ipv6}]:{self.port}', lat)
+        avg = self.stats['lat_avg']
+        self.stats['lat_avg'] = lat if avg is None else 0.9 * avg + 0.1 * lat
+        self.stats['lat_max'] = max(self.stats['lat_max'], lat)
+
+    async def _send(self, msgs):
+        start = time.monotonic()
+
+        if self.writer is None or self.writer.is_closing():
+            await self._connect()
+
+        if self.legacy:
+            # old peers read one message up to end of stream
+            frames = [(msg.name(True), msg.legacy_frame()) for msg in msgs]
+            for _, frame in frames:
+                if self.writer is None:
+                    await self._connect()
+                self.writer.write(frame)
+                await asyncio.wait_for(self.writer.drain(), self.timeout)
+                self.close()
+        else:
+            frames = [(msg.name(Wire.CAP_INV not in self.caps), msg.frame_for(self.caps)) for msg in msgs]
+            self.writer.write(b''.join(frame for _, frame in frames))
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+        # bytes per message type, gossip cost per block is read from here
+        for name, frame in frames:
+            METRICS.count('net_bytes', name, len(frame))
+
+        self._latency(time.monotonic() - start)
+        self.stats['sent'] += len(msgs)
+        self.backoff = PeerConn.BACKOFF_MIN
+
+    async def serve(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < PeerConn.BATCH_MAX and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # peer is backing off after a failure, do not stall the queue on it
+            if self.writer is None and time.monotonic() < self.retry_at:
+                self.stats['dropped'] += len(batch)
+                for _, fut in batch:
+                    fut.set_result(False)
+                continue
+
+            try:
+                await self._send([msg for msg, _ in batch])
+                ok = True
+            except (ConnectionError, TimeoutError, asyncio.TimeoutError, OSError):
+                self._fail()
+                ok = False
+
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_result(ok)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class PeerPool:
+    def __init__(self, timeout=None, queue_max=None):
+        self.timeout = timeout
+        self.queue_max = queue_max
+        self.conns = {}
+        self.loop = None
+
+    def get(self, ipv6, port):
+        # connections are bound to the loop they were opened in
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.conns.clear()
+            self.loop = loop
+
+        key = (ipv6, port)
+        if self.conns.get(key) is None:
+            self.conns[key] = PeerConn(ipv6, port, self.timeout, self.queue_max)
+        return self.conns[key]
+
+    async def broadcast(self, msg, peers):
+        futs = [self.get(peer.ipv6, peer.port).put(msg) for peer in peers]
+        return await asyncio.gather(*futs)
+
+    async def stream(self, msgs, peers):
+        # every message over one connection per peer, in order, delivered count per peer
+        async def to_peer(peer):
+            conn = self.get(peer.ipv6, peer.port)
+            futs = [await conn.put_wait(msg) for msg in msgs]
+            return sum(await asyncio.gather(*futs))
+
+        return await asyncio.gather(*[to_peer(peer) for peer in peers])
+
+    def stats(self):
+        return {f'[{ipv6}]:{port}': dict(conn.stats, queued=conn.queue.qsize()) for (ipv6, port), conn in self.conns.items()}
+
+    def close(self):
+        for conn in self.conns.values():
+            if conn.task is not None:
+                conn.task.cancel()
+            conn.close()
+        self.conns.clear()
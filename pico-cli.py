@@ -1,15 +1,25 @@
+import sys
 import json
+import time
 import argparse
 import asyncio
 import os.path
 
 from getpass import getpass
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
 from aiofile import async_open
 
-from dacite import from_dict
+from dacite import from_dict, DaciteError
 
-from miner import Miner
-from core import User, Peer, Net, Transaction, Invoice, Payment, Message, Reward, Block, Blockchain, BlockCheck
+from miner import Miner, MinerBackend
+from store import BlockStore
+from mempool import Mempool
+from sync import Sync
+from gossip import Gossip
+import primes
+from metrics import METRICS, Metrics
+from core import DataHashable, User, UserSession, Peer, Net, Transaction, Invoice, Payment, Message, Reward, Block, LazyBlocks, Blockchain, BlockCheck, TransCheck, PowVerifier
 
 
 class CLI:
@@ -17,18 +27,31 @@ class CLI:
         self.net = None
         self.usr = None
         self.chain = None
+        self.store = None
+        # one writer thread, appends from sync and gossip never interleave
+        self.store_writer = ThreadPoolExecutor(max_workers=1)
+        self.sync = None
+        self.session = None
+        self.session_ttl = None
 
     @staticmethod
     async def _dict_to_disk(obj, obj_path):
+        start = time.perf_counter()
         async with async_open(obj_path, 'w') as f:
             obj_json = json.dumps(obj.to_dict(), indent=4)
             await f.write(obj_json)
+        METRICS.observe('dict_to_disk', time.perf_counter() - start)
 
     @staticmethod
     async def _dict_from_disk(obj_path):
         async with async_open(obj_path, 'r') as f:
             return json.loads(await f.read())
 
+    async def _block_to_disk(self, block):
+        # append only the accepted block, fsync happens on the store tail
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.store_writer, self.store.append, block.dict_hash(), block.to_dict())
+
     @staticmethod
     def _init_ser_obj(obj_path, obj_reader, obj_maker):
         obj = None
@@ -39,7 +62,7 @@ class CLI:
             asyncio.run(CLI._dict_to_disk(obj, obj_path))
         return obj
 
-    def net_init(self, peers_path):
+    def net_init(self, peers_path, announce=True):
         def maker():
             net = Net(hash=None)
             net.add_peer(Peer('2002:c257:6f39::1', 10000))
@@ -48,18 +71,39 @@ class CLI:
 
         reader = lambda d: from_dict(Net, d)
         self.net = CLI._init_ser_obj(peers_path, reader, maker)
-        self.update_self_peer()
+        if announce:
+            self.update_self_peer()
 
     def usr_init(self, usr_path):
         reader = CLI.usr_login
         maker = CLI.usr_reg
         self.usr = CLI._init_ser_obj(usr_path, reader, maker)
 
-    def chain_init(self, chain_path):
-        # FIXME: fetch blockchain from another node
-        reader = lambda d: from_dict(Blockchain, d)
-        maker = lambda: Blockchain(ver='0.1', blocks={}, hash=None)
-        self.chain = CLI._init_ser_obj(chain_path, reader, maker)
+    def chain_init(self, chain_path, store_path, verify=False):
+        start = time.perf_counter()
+        self.store = BlockStore(store_path)
+
+        # one-shot import from legacy json blockchain
+        if not len(self.store) and os.path.exists(chain_path):
+            count = self.store.import_chain(asyncio.run(CLI._dict_from_disk(chain_path)))
+            print(f'Imported {count} blocks from {chain_path}.')
+
+        # store records are trusted, hashes are checked again only on request
+        blocks = LazyBlocks(self.store, verify=verify)
+        if verify:
+            bad = blocks.verify_all()
+            for h in bad:
+                print(f'Block {h[0:12]} in store has invalid hash.')
+            if bad:
+                exit(1)
+
+        self.chain = Blockchain(ver='0.1', blocks=blocks, hash=None)
+        self.sync = Sync(self.chain, self.store)
+        METRICS.observe('chain_init', time.perf_counter() - start)
+
+    def chain_export(self, chain_path):
+        asyncio.run(CLI._dict_to_disk(self.chain, chain_path))
+        print(f'Exported {self.chain.blocks_count()} blocks to {chain_path}.')
 
     @staticmethod
     def act_with_passwd(act):
@@ -69,6 +113,10 @@ class CLI:
                 return act(passwd)
             except KeyboardInterrupt:
                 exit()
+            except EOFError:
+                # no terminal and nothing left on stdin, asking again would loop forever
+                print('No password given.')
+                exit(1)
             except Exception:
                 print('Invalid password!')
 
@@ -89,6 +137,12 @@ class CLI:
     def passwd(self):
         return CLI.act_with_passwd(self.usr.check_passwd)
 
+    def unlock(self):
+        # password is asked again only after session expired
+        if self.session is None or not self.session.is_open():
+            self.session = CLI.act_with_passwd(lambda passwd: UserSession(self.usr, passwd, self.session_ttl))
+        return self.session
+
     @staticmethod
     def usr_login(usr_dict):
         return from_dict(User, usr_dict)
@@ -101,21 +155,108 @@ class CLI:
     def make_trans(self, trans):
         ans = input('Do u want to make a transaction? [y/n]: ')
         if ans in ('y', 'Y'):
-            trans.sign(self.usr, self.passwd())
+            trans.dict_sign(self.unlock())
             asyncio.run(self.net.send({'trans': trans.to_dict()}))
             print(trans.to_dict())
 
+    @staticmethod
+    def parse_bulk_trans(line, pub):
+        # {"to_adr": "<pub key>", "act": {"pay": 10}}, same action keys as --trans
+        trans_dict = json.loads(line)
+        act = trans_dict['act']
+
+        # json true and false are ints to isinstance, amounts must be plain numbers
+        key = next(iter(act)) if isinstance(act, dict) and len(act) == 1 else None
+        if key not in ('ivc', 'pay', 'msg') or type(act[key]) not in ((str,) if key == 'msg' else (int, float)):
+            raise ValueError(f'unknown action: {act!r}')
+
+        return Transaction(from_adr=pub, to_adr=str(trans_dict['to_adr']), act=Transaction.ACTS[key](act[key]), hash=None, sign=None)
+
+    def bulk_mempool(self):
+        return Mempool(self.chain)
+
+    def bulk_trans(self, path):
+        # stdin stays open, password is read from terminal or from stdin after a file
+        if path == '-':
+            lines = list(enumerate(sys.stdin, 1))
+        else:
+            with open(path) as f:
+                lines = list(enumerate(f, 1))
+        lines = [(n, line) for n, line in lines if line.strip()]
+
+        results, trans = {}, []
+        for n, line in lines:
+            try:
+                trans.append((n, CLI.parse_bulk_trans(line, self.usr.pub)))
+            except (ValueError, KeyError, TypeError) as e:
+                results[n] = f'malformed: {str(e)}'
+
+        if not trans:
+            for n, _ in lines:
+                print(f'Line {n}: {results[n]}')
+            print(f'Bulk: no transactions in {len(lines)} lines.')
+            return []
+
+        start = time.perf_counter()
+        self.unlock().sign_batch([t for _, t in trans])
+        t_sign = time.perf_counter() - start
+
+        # checked in order against chain balances and each other, as a miner would
+        start = time.perf_counter()
+        mempool, accepted = self.bulk_mempool(), []
+        for n, t in trans:
+            reason = mempool.add(t)
+            if reason is TransCheck.OK:
+                accepted.append(t)
+                results[n] = f'{t.dict_hash()[0:12]} accepted'
+            else:
+                results[n] = f'{t.dict_hash()[0:12]} rejected: {str(reason)}'
+        t_check = time.perf_counter() - start
+
+        start = time.perf_counter()
+        peers, sent = asyncio.run(self.net.send_many([{'trans': t.to_dict()} for t in accepted]))
+        t_send = time.perf_counter() - start
+
+        for n, _ in lines:
+            print(f'Line {n}: {results[n]}')
+
+        print(f'Bulk: {len(accepted)}/{len(lines)} transactions accepted, signed {len(trans) / max(t_sign, 1e-9):.0f}/s, checked {len(trans) / max(t_check, 1e-9):.0f}/s, sent {len(accepted) / max(t_send, 1e-9):.0f}/s.')
+        for peer, count in zip(peers, sent):
+            print(f'Peer [{peer.ipv6}]:{peer.port}: {count}/{len(accepted)} delivered.')
+        return accepted
+
+    def print_history(self, page, size):
+        total = self.chain.ledger.history_count(self.usr.pub)
+        print(f'History: page {page}, {total} transactions total.')
+
+        for h in self.chain.get_history(self.usr.pub, page, size):
+            for trans in self.chain.get_trans(h):
+                print(f'{trans.time} {h[0:12]} {trans.from_adr} -> {trans.to_adr}: {asdict(trans.act)}')
+
     def update_self_peer(self):
         self.net.update_peer(Peer(self.net.ipv6, 10000))
-        asyncio.run(self.net.send(self.net.to_dict()))
+        asyncio.run(self.net.send({'peers': self.net.to_dict()['peers']}))
         asyncio.run(self._dict_to_disk(self.net, 'peers.json'))
 
 
 class CoreServer(CLI):
     def __init__(self):
         super().__init__()
-
-    async def update_peers_hlr(self, peers_dict):
+        self.sync_start = True
+        self.gossip = Gossip()
+        # hash -> running check of a gossiped block
+        self.checking = {}
+        self.chain_cond = None
+        self.tasks = []
+
+        self.stats_port = None
+        self.stats_serv = None
+        self.stats_dump = None
+        self.stats_every = 60
+        self.profile_path = None
+        self.profile_window = 5
+
+    async def update_peers_hlr(self, peers_dict, src=None):
         peers = [Peer(peer['ipv6'], peer['port']) for peer in peers_dict]
 
         if self.net.update_peers(peers):
@@ -124,73 +265,285 @@ class CoreServer(CLI):
             await self.net.send({'peers': peers_dict})
             await self._dict_to_disk(self.net, 'peers.json')
 
-    async def add_block_hlr(self, block_dict):
+    def required_confirms(self):
+        # every peer confirms once, small networks can not give more
+        peers = [peer for peer in self.net.peers if peer.ipv6 != self.net.ipv6]
+        return max(1, min(Blockchain.BLOCK_REQUIRED_CONFIRMS, len(peers)))
+
+    async def confirm_block(self, block, src=None, work_checked=False):
+        if self.chain.add_block(block, src, self.required_confirms(), work_checked):
+            await self.block_accepted(block)
+        await self.chain_changed()
+
+    async def relay_block(self, block):
+        # hash to every peer, sender included as the inv is its confirm, payload only on get_data
+        await self.net.send(Gossip.inv('block', [block.dict_hash()]), legacy={'block': block.to_dict()})
+
+    async def _gossip_check(self, block):
+        # cheap chain checks first, pow off the loop only for blocks that pass them
+        reason = self.chain.check_block(block, work_checked=True)
+        if reason is BlockCheck.OK and not await self.chain.work_check_async(block):
+            reason = BlockCheck.POW_FAILED
+        if reason is BlockCheck.OK:
+            return True
+
+        # broken blocks are remembered, the rest may pass once the chain moves
+        print(f'Block {block.dict_hash()[0:12]} not relayed: {str(reason)}.')
+        return False if reason in (BlockCheck.INVALID_HASH, BlockCheck.POW_FAILED) else None
+
+    async def gossip_check(self, block):
+        # copies coming while the first is checked wait for its result
+        h = block.dict_hash()
+        task = self.checking.get(h)
+        if task is None:
+            task = asyncio.ensure_future(self._gossip_check(block))
+            task.add_done_callback(lambda _: self.checking.pop(h, None))
+            self.checking[h] = task
+        return await task
+
+    async def add_block_hlr(self, block_dict, src=None):
         block = from_dict(Block, block_dict)
+        h = block.dict_hash()
+
+        if not self.gossip.is_seen(h):
+            valid = await self.gossip_check(block)
+            if self.gossip.offer('block', h, block, lambda: valid):
+                await self.relay_block(block)
+
+                # peers that announced it while it was downloading
+                for peer in self.gossip.take_announcers(h) - {src}:
+                    await self.confirm_block(block, peer, True)
+
+        # work of every later copy is known from the first one
+        if self.gossip.is_valid(h):
+            await self.confirm_block(block, src, True)
+
+    async def inv_hlr(self, inv, src=None):
+        # inv of a held block is a confirm from its sender
+        for h in Gossip.hashes(inv, 'block'):
+            block = self.gossip.get('block', h)
+            if block is not None and h not in self.chain.blocks:
+                await self.confirm_block(block, src, True)
+
+        req = self.gossip.wanted(inv, src)
+        if req is not None:
+            await self.net.send(req, [self.net.get_peer(src)])
+
+    async def serve_gossip(self):
+        # payloads an announcer did not send in time are asked from the next one
+        while True:
+            await asyncio.sleep(Gossip.ASK_TIMEOUT / 2)
+            for src, req in self.gossip.retry():
+                await self.net.send(req, [self.net.get_peer(src)])
 
-        if self.chain.check_block(block) is BlockCheck.OK:
-            await self.net.send({'block': block.to_dict()})
+    async def get_data_hlr(self, req, src=None):
+        peer = self.net.get_peer(src)
+        for data_dict in self.gossip.get_data(req):
+            await self.net.send(data_dict, [peer])
 
-        if self.chain.add_block(block):
-            await self._dict_to_disk(self.chain, 'blockchain.json')
+    async def block_accepted(self, block):
+        await self._block_to_disk(block)
 
-    async def serve_dispatch(self, data):
+    async def chain_changed(self):
+        # wake up everyone waiting on block confirmations
+        async with self.chain_cond:
+            self.chain_cond.notify_all()
+
+    async def serve_dispatch(self, data, src=None):
         hlr_map = {
             'peers': self.update_peers_hlr,
-            'block': self.add_block_hlr
+            'block': self.add_block_hlr,
+            'inv': self.inv_hlr,
+            'get_data': self.get_data_hlr
+        }
+
+        # requests, answer is sent back to the asking peer
+        req_map = {
+            'get_hashes': self.sync.get_hashes_hlr,
+            'get_blocks': self.sync.get_blocks_hlr
         }
 
         for key, hlr in hlr_map.items():
             if data.get(key):
-                await hlr(data[key])
+                await hlr(data[key], src)
+
+        for key, hlr in req_map.items():
+            if key in data:
+                return hlr(data[key])
+
+    async def serve_sync(self):
+        if self.sync_start:
+            peers = [peer for peer in self.net.peers if peer.ipv6 != self.net.ipv6]
+            await self.sync.run(peers, self.block_accepted)
+
+    def register_metrics(self):
+        METRICS.gauge('chain_height', self.chain.blocks_count)
+        METRICS.gauge('chain_work', lambda: self.chain.topo.get_work(self.chain.topo.tip))
+        METRICS.gauge('blocks_pending', lambda: sum(len(c) for c in self.chain.blocks_cache.values()))
+        METRICS.gauge('peers', lambda: len(self.net.peers))
+        METRICS.gauge('peer_conns', self.net.peer_stats)
+        METRICS.gauge('hash_cache', DataHashable.hash_stats)
+        METRICS.gauge('verify_cache', lambda: User.VERIFY_CACHE.stats)
+        METRICS.gauge('gossip', self.gossip_stats)
+        METRICS.gauge('primes', lambda: dict(primes.STATS, memo_size=len(primes.MEMO)))
+
+    def gossip_stats(self):
+        # bytes of block traffic over blocks seen, whole network cost is this times nodes count
+        sent = METRICS.counters.get('net_bytes', {})
+        block_bytes = sum(sent.get(k, 0) for k in ('block', 'inv', 'get_data'))
+        return dict(self.gossip.stats, seen=len(self.gossip.seen), bytes_per_block=block_bytes / max(self.gossip.stats['relayed']['block'], 1))
+
+    async def serve_metrics(self):
+        self.register_metrics()
+        loop = asyncio.get_running_loop()
+
+        if self.stats_port:
+            self.stats_serv = await METRICS.serve_http(self.stats_port)
+            print(f'Stats served on http://127.0.0.1:{self.stats_port}/')
+
+        if self.stats_dump:
+            self.tasks.append(loop.create_task(METRICS.dump_forever(self.stats_dump, self.stats_every)))
+
+        if self.profile_path:
+            self.tasks.append(loop.create_task(Metrics.profile_forever(self.profile_path, self.stats_every, self.profile_window)))
+
+    def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
+
+        if self.stats_serv is not None:
+            self.stats_serv.close()
+
+        self.net.pool.close()
+        if self.chain.verifier is not None:
+            self.chain.verifier.close()
+        self.store_writer.shutdown()
+        self.store.close()
 
     async def serve_forever(self):
-        self.net.serv_init(self.serve_dispatch)
+        # loop bound primitives are created inside the running loop
+        self.chain_cond = asyncio.Condition()
+        await self.net.serv_init(self.serve_dispatch)
+        await self.serve_metrics()
 
         loop = asyncio.get_running_loop()
-        loop.create_task(self.net.serv)
+        self.tasks.append(loop.create_task(self.serve_sync()))
+        self.tasks.append(loop.create_task(self.serve_gossip()))
 
-        while True:
-            await asyncio.sleep(0)
+        try:
+            async with self.net.serv:
+                await self.net.serv.serve_forever()
+        finally:
+            self.shutdown()
 
 
 class MiningServer(CoreServer):
-    def __init__(self):
+    def __init__(self, backend=MinerBackend.MINER_BACKEND_SYMPY, checkpoint_path='mining.json', workers=None):
         super().__init__()
         self.block = None
-        self.miner = Miner()
-        self.trans_cache = []
+        self.miner = Miner(backend, workers=workers)
+        self.mempool = None
+        self.checkpoint_path = checkpoint_path
+
+    def chain_init(self, chain_path, store_path, verify=False):
+        super().chain_init(chain_path, store_path, verify)
+        self.mempool = Mempool(self.chain)
+
+    def register_metrics(self):
+        super().register_metrics()
+        METRICS.gauge('mempool', lambda: {'trans': len(self.mempool), 'orphans': len(self.mempool.orphans), 'senders': len(self.mempool.reserved), 'rewards': len(self.mempool.rewards)})
+        METRICS.gauge('miner', lambda: self.miner.stats)
+
+    def shutdown(self):
+        super().shutdown()
+        self.miner.close()
 
     def cache_trans(self, trans):
-        print(f'Transaction {trans.dict_hash()[0:12]} will be in next block.')
-        self.trans_cache.append(trans)
+        h = trans.dict_hash()
+
+        reason = self.mempool.add(trans)
+        if reason is not TransCheck.OK:
+            print(f'Transaction {h[0:12]} rejected: {str(reason)}.')
+            return
+
+        print(f'Transaction {h[0:12]} will be in next block.')
 
     def make_trans(self, trans):
         super().make_trans(trans)
         self.cache_trans(trans)
 
+    def bulk_mempool(self):
+        # accepted transactions go straight to the next block
+        return self.mempool
+
     async def update_block(self):
         # wait until block will be accepted or rejected
-        while self.chain.get_block_confirms(self.block):
-            await asyncio.sleep(0)
+        async with self.chain_cond:
+            await self.chain_cond.wait_for(lambda: not self.chain.get_block_confirms(self.block))
+
+        # continue partial work from previous run
+        self.block = await self.resume_block()
+        if self.block is not None:
+            print(f'Block {self.block.dict_hash()[0:12]} resumed at {len(self.block.pow.work)}/{self.block.v_diff}.')
+            return
 
         # generate new block
         self.block = self.chain.new_block(self.usr.pub)
 
-        # clear transactions queue
-        for trans in self.trans_cache:
+        # fill block from mempool, transactions leave it once block is accepted
+        for trans in self.mempool.select():
             self.chain.add_trans(self.block, trans)
-        self.trans_cache.clear()
+
+    async def checkpoint(self, block):
+        await self._dict_to_disk(block, self.checkpoint_path)
+
+    def drop_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    async def resume_block(self):
+        if not os.path.exists(self.checkpoint_path):
+            return None
+
+        try:
+            block = from_dict(Block, await self._dict_from_disk(self.checkpoint_path))
+        except (ValueError, TypeError, DaciteError):
+            self.drop_checkpoint()
+            return None
+
+        # checkpoint hash is stale, work was added after it was set
+        block.hash = block.dict_hash()
+
+        # partial work is useful only on top of current chain
+        prev = self.chain.last_block()
+        valid = (block.prev == (prev.dict_hash() if prev else None)) and (block.pow.solver == self.usr.pub)
+        valid = valid and (block.h_diff == self.chain.get_h_diff(prev)) and (block.v_diff == block.get_v_diff())
+        valid = valid and all(self.chain.check_trans(trans) is TransCheck.OK for trans in block.trans.values())
+
+        if not valid:
+            self.drop_checkpoint()
+            return None
+        return block
+
+    async def block_accepted(self, block):
+        await super().block_accepted(block)
+        self.mempool.remove_block(block)
+
+        # competing block for the same prev makes current work stale
+        if (self.block is not None) and (block is not self.block) and (block.prev == self.block.prev):
+            self.miner.cancel()
 
     def add_trans_hlr(self, trans_dict):
         trans = from_dict(Transaction, trans_dict)
         self.cache_trans(trans)
 
-    async def serve_dispatch(self, data):
-        await super().serve_dispatch(data)
+    async def serve_dispatch(self, data, src=None):
+        reply = await super().serve_dispatch(data, src)
 
         # add trans
         if data.get('trans'):
             self.add_trans_hlr(data['trans'])
+        return reply
 
     async def serve_mining(self):
         while True:
@@ -198,55 +551,104 @@ class MiningServer(CoreServer):
 
             # mining
             self.miner.set_block(self.block)
-            await self.miner.work()
+            solved = await self.miner.work(self.checkpoint)
+            self.drop_checkpoint()
+
+            if solved is None:
+                lost = self.miner.discard()
+                print(f'Block {self.block.dict_hash()[0:12]} is stale, mining canceled: {lost:.1f}s of work discarded, {self.miner.stats["discarded_time"]:.1f}s total.')
+                self.block = None
+                continue
+
             print(f'Block {self.block.dict_hash()[0:12]} solved: reward {self.chain.reward()} picocoins.')
 
             # check and send
-            if self.chain.check_block(self.block) is BlockCheck.OK:
+            checked = await self.gossip_check(self.block) is True
+            if checked:
                 reward_act = Reward(self.chain.reward(), self.block.dict_hash())
                 reward_trans = Transaction(from_adr=None, to_adr=self.block.pow.solver, act=reward_act, hash=None, sign=None)
                 self.cache_trans(reward_trans)
 
                 await self.net.send({'trans': reward_trans.to_dict()})
-                await self.net.send({'block': self.block.to_dict()})
+                self.gossip.offer('block', self.block.dict_hash(), self.block)
+                await self.relay_block(self.block)
+                await self.confirm_block(self.block, work_checked=True)
+            else:
+                self.miner.discard()
+                await self.chain_changed()
 
-            if self.chain.add_block(self.block):
-                await self._dict_to_disk(self.chain, 'blockchain.json')
-
-    async def serve_forever(self):
-        loop = asyncio.get_running_loop()
-        loop.create_task(self.serve_mining())
-
-        while True:
-            await super().serve_forever()
+    async def serve_sync(self):
+        # mine on top of synced chain only
+        await super().serve_sync()
+        await self.serve_mining()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog='python3 pico-cli.py', description='PicoCoin core cli.')
     parser.add_argument('--usr', type=str, default='user.json', help='path to user keys')
-    parser.add_argument('--chain', type=str, default='blockchain.json', help='path to blockchain')
+    parser.add_argument('--chain', type=str, default='blockchain.json', help='path to json blockchain, imported once into empty store')
+    parser.add_argument('--store', type=str, default='blocks', help='path to block store directory')
+    parser.add_argument('--verify-store', action='store_true', help='check every stored block hash on start')
+    parser.add_argument('--export-chain', type=str, metavar='path', help='export block store to json blockchain and exit')
     parser.add_argument('--peers', type=str, default='peers.json', help='path to peers')
+    parser.add_argument('--no-sync', action='store_true', help='do not download missing blocks from peers on start')
     parser.add_argument('--mining', action='store_true', help='work as mining server')
+    parser.add_argument('--miner-backend', type=str, default=MinerBackend.MINER_BACKEND_SYMPY, choices=list(MinerBackend.BACKENDS), help='factorization backend (default: "sympy")')
+    parser.add_argument('--miner-workers', type=int, help='processes racing on one number with "race" backend (default: cores count)')
+    parser.add_argument('--checkpoint', type=str, default='mining.json', help='path to partial mining work, resumed on restart (default: "mining.json")')
+    parser.add_argument('--verify-workers', type=int, default=1, help='processes for proof of work verification (default: 1)')
     parser.add_argument('--adr',  type=str, default='127.0.0.1', help='server listen address (default: "127.0.0.1")')
     parser.add_argument('--trans', nargs=3, metavar=('to', 'act', 'args'), help='make a transaction')
+    parser.add_argument('--bulk-trans', type=str, metavar='path', help='make transactions from jsonl file, "-" for stdin')
+    parser.add_argument('--session-ttl', type=float, default=UserSession.TTL, help='seconds unlocked key is kept for signing (default: 300)')
     parser.add_argument('--bal', action='store_true', help='get user balance')
+    parser.add_argument('--history', action='store_true', help='get user transactions history')
+    parser.add_argument('--page', type=int, default=0, help='history page, newest first (default: 0)')
+    parser.add_argument('--page-size', type=int, default=10, help='history page size (default: 10)')
+    parser.add_argument('--stats-port', type=int, help='serve node metrics as json on http://127.0.0.1:<port>/')
+    parser.add_argument('--stats-dump', type=str, metavar='path', help='periodically dump node metrics as json')
+    parser.add_argument('--stats-every', type=float, default=60, help='metrics dump and profile period in seconds (default: 60)')
+    parser.add_argument('--profile', type=str, metavar='path', help='profile a window every period with cProfile, pstats dump')
+    parser.add_argument('--profile-window', type=float, default=5, help='profiled seconds per period (default: 5)')
     parser.add_argument('--debg', action='store_true', help='debug mode (use with \'python3 -i\' flag)')
 
     args = parser.parse_args()
 
     # init core server
-    serv = CoreServer() if not args.mining else MiningServer()
+    serv = CoreServer() if not args.mining else MiningServer(args.miner_backend, args.checkpoint, args.miner_workers)
 
     serv.usr_init(args.usr)
-    serv.chain_init(args.chain)
+    serv.session_ttl = args.session_ttl
+    serv.chain_init(args.chain, args.store, args.verify_store)
+
+    if args.verify_workers > 1:
+        serv.chain.verifier = PowVerifier(args.verify_workers)
+
+    # export blockchain
+    if args.export_chain:
+        serv.chain_export(args.export_chain)
+        exit()
 
     # get balance
     if args.bal:
         print(f'Balance: {serv.chain.get_bal(serv.usr.pub)} picocoins.')
-        if not args.mining:
-            exit()
 
-    serv.net_init(args.peers)
+    # get transactions history
+    if args.history:
+        serv.print_history(args.page, args.page_size)
+
+    if (args.bal or args.history) and not args.mining:
+        exit()
+
+    # one-shot bulk submit does not announce itself to peers
+    serv.net_init(args.peers, announce=args.mining or not args.bulk_trans)
+    serv.sync_start = not args.no_sync
+
+    serv.stats_port = args.stats_port
+    serv.stats_dump = args.stats_dump
+    serv.stats_every = args.stats_every
+    serv.profile_path = args.profile
+    serv.profile_window = args.profile_window
 
     # make transaction
     if args.trans:
@@ -259,12 +661,22 @@ if __name__ == '__main__':
             'msg': lambda: Message(act_args)
         }[args.trans[1]]()
 
-        trans = Transaction(from_adr=serv.usr.pub, to_adr=to, act=act, hash=None)
+        trans = Transaction(from_adr=serv.usr.pub, to_adr=to, act=act, hash=None, sign=None)
         serv.make_trans(trans)
 
         if not args.mining:
             exit()
 
+    # make transactions in bulk
+    if args.bulk_trans:
+        serv.bulk_trans(args.bulk_trans)
+
+        if not args.mining:
+            exit()
+
     # serve
     if not args.debg:
-        asyncio.run(serv.serve_forever())
+        try:
+            asyncio.run(serv.serve_forever())
+        except KeyboardInterrupt:
+            print('Server stopped.')
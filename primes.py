@@ -0,0 +1,171 @@
+import threading
+
+from math import gcd, isqrt
+from collections import OrderedDict
+
+
+def sieve(limit):
+    # flag per number, 1 for primes
+    table = bytearray([1]) * (limit + 1)
+    table[0:2] = b'\x00\x00'
+
+    for i in range(2, isqrt(limit) + 1):
+        if table[i]:
+            table[i * i::i] = bytearray(len(range(i * i, limit + 1, i)))
+    return table
+
+
+def primes_upto(limit):
+    return [i for i, v in enumerate(sieve(limit)) if v]
+
+
+SIEVE_LIMIT = 1 << 20
+SIEVE = sieve(SIEVE_LIMIT)
+
+# product of primes below 200, one gcd instead of trial divisions
+TRIAL_PRODUCT = 1
+for _p in primes_upto(200):
+    TRIAL_PRODUCT *= _p
+
+# (bound, bases), Miller-Rabin with these bases is deterministic below bound, see miller-rabin.appspot.com
+# above it bpsw is faster than more bases
+MR_BASES = (
+    (1050535501, (336781006125, 9639812373923155)),
+    (350269456337, (4230279247111683200, 14694767155120705706, 16641139526367750375)),
+    (55245642489451, (2, 141889084524735, 1199124725622454117, 11096072698276303650)),
+    (7999252175582851, (2, 4130806001517, 149795463772692060, 186635894390467037, 3967304179347715805)),
+)
+MR_LIMIT = MR_BASES[-1][0]
+
+# proven primes above sieve, same block is checked again for every confirm and by sync
+MEMO_MAX = 1 << 14
+MEMO = OrderedDict()
+# pow checks run on executor threads next to the event loop
+MEMO_LOCK = threading.Lock()
+
+STATS = {'sieve': 0, 'trial': 0, 'mr': 0, 'bpsw': 0, 'memo': 0}
+
+
+def _is_sprp(n, a, d=None, s=None):
+    if d is None:
+        d, s = n - 1, 0
+        while not d & 1:
+            d >>= 1
+            s += 1
+
+    x = pow(a, d, n)
+    if x == 1 or x == n - 1:
+        return True
+
+    for _ in range(s - 1):
+        x = x * x % n
+        if x == n - 1:
+            return True
+    return False
+
+
+def _jacobi(a, n):
+    a %= n
+    res = 1
+    while a:
+        while not a & 1:
+            a >>= 1
+            if n & 7 in (3, 5):
+                res = -res
+        a, n = n, a
+        if a & 3 == 3 and n & 3 == 3:
+            res = -res
+        a %= n
+    return res if n == 1 else 0
+
+
+def _is_slprp(n):
+    # strong lucas probable prime test, selfridge parameters
+    d = 5
+    while True:
+        j = _jacobi(d, n)
+        if j == -1:
+            break
+        if j == 0 and abs(d) != n:
+            return False
+        d = -d - 2 if d > 0 else -d + 2
+        if d == -15 and isqrt(n) ** 2 == n:
+            return False
+
+    p, q = 1, (1 - d) // 4
+
+    k, s = n + 1, 0
+    while not k & 1:
+        k >>= 1
+        s += 1
+
+    # lucas chain for U_k, V_k, Q^k
+    u, v, qk = 0, 2, 1
+    for bit in bin(k)[2:]:
+        u, v = u * v % n, (v * v - 2 * qk) % n
+        qk = qk * qk % n
+        if bit == '1':
+            u, v = p * u + v, d * u + p * v
+            u = (u if not u & 1 else u + n) // 2 % n
+            v = (v if not v & 1 else v + n) // 2 % n
+            qk = qk * q % n
+
+    if u == 0 or v == 0:
+        return True
+
+    for _ in range(s - 1):
+        v = (v * v - 2 * qk) % n
+        if v == 0:
+            return True
+        qk = qk * qk % n
+    return False
+
+
+def _is_mr(n):
+    d, s = n - 1, 0
+    while not d & 1:
+        d >>= 1
+        s += 1
+
+    bases = next(b for bound, b in MR_BASES if n < bound)
+    for a in bases:
+        # bases may be above n, reduced to 0 or 1 they prove nothing
+        a %= n
+        if a > 1 and not _is_sprp(n, a, d, s):
+            return False
+    return True
+
+
+def _is_bpsw(n):
+    # proven below 2^64 (Feitsma), no composite is known to pass above
+    return _is_sprp(n, 2) and _is_slprp(n)
+
+
+def is_prime(n):
+    if n <= SIEVE_LIMIT:
+        STATS['sieve'] += 1
+        return n >= 0 and bool(SIEVE[n])
+
+    if gcd(n, TRIAL_PRODUCT) != 1:
+        STATS['trial'] += 1
+        return False
+
+    with MEMO_LOCK:
+        if n in MEMO:
+            STATS['memo'] += 1
+            MEMO.move_to_end(n)
+            return True
+
+    if n < MR_LIMIT:
+        STATS['mr'] += 1
+        prime = _is_mr(n)
+    else:
+        STATS['bpsw'] += 1
+        prime = _is_bpsw(n)
+
+    if prime:
+        with MEMO_LOCK:
+            MEMO[n] = True
+            if len(MEMO) > MEMO_MAX:
+                MEMO.popitem(last=False)
+    return prime
@@ -0,0 +1,178 @@
+import os
+import json
+import zlib
+import mmap
+import struct
+
+from codec import Codec, CodecError
+from metrics import METRICS
+
+
+class BlockStore:
+    # record: payload length, payload crc32, block hash | payload (binary codec or compact json)
+    REC_HEAD = struct.Struct('<II64s')
+    SEG_SIZE = 64 * 1024 * 1024
+    SEG_EXT = '.seg'
+
+    def __init__(self, path, seg_size=None, binary=True):
+        self.path = path
+        self.seg_size = seg_size or BlockStore.SEG_SIZE
+        self.binary = binary
+
+        self.index = {}
+        self.heights = []
+        self.segs = []
+        self.maps = {}
+        self.tail = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self._open()
+
+    def _seg_path(self, seg):
+        return os.path.join(self.path, f'{seg:08d}{BlockStore.SEG_EXT}')
+
+    def _open(self):
+        names = sorted(n for n in os.listdir(self.path) if n.endswith(BlockStore.SEG_EXT))
+        self.segs = [int(n[:-len(BlockStore.SEG_EXT)]) for n in names]
+
+        for seg in self.segs:
+            # only the tail can be torn by a crash, so verify payloads there only
+            self._scan(seg, verify=(seg == self.segs[-1]))
+
+        if not self.segs:
+            self.segs.append(0)
+        self.tail = open(self._seg_path(self.segs[-1]), 'ab')
+
+    def _scan(self, seg, verify):
+        head_size = BlockStore.REC_HEAD.size
+
+        with open(self._seg_path(seg), 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            off = 0
+
+            while off + head_size <= size:
+                f.seek(off)
+                length, crc, h = BlockStore.REC_HEAD.unpack(f.read(head_size))
+                if off + head_size + length > size:
+                    break
+                if verify and zlib.crc32(f.read(length)) != crc:
+                    break
+
+                self._add_index(h.decode(), seg, off + head_size, length)
+                off += head_size + length
+
+        # drop a partially written tail record
+        if off != size:
+            with open(self._seg_path(seg), 'r+b') as f:
+                f.truncate(off)
+
+    def _add_index(self, block_hash, seg, off, length):
+        self.index[block_hash] = (seg, off, length)
+        self.heights.append(block_hash)
+
+    def _map(self, seg, end):
+        m = self.maps.get(seg)
+        if m is None or len(m) < end:
+            if m is not None:
+                m.close()
+            with open(self._seg_path(seg), 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[seg] = m
+        return m
+
+    def _rotate(self):
+        self.tail.close()
+        self.segs.append(self.segs[-1] + 1)
+        self.tail = open(self._seg_path(self.segs[-1]), 'ab')
+
+    def close(self):
+        for m in self.maps.values():
+            m.close()
+        self.maps.clear()
+
+        if self.tail:
+            self.tail.close()
+            self.tail = None
+
+    def __len__(self):
+        return len(self.heights)
+
+    def __contains__(self, block_hash):
+        return block_hash in self.index
+
+    @METRICS.timed('store_append')
+    def append(self, block_hash, block_dict):
+        if block_hash in self.index:
+            return False
+
+        payload = BlockStore.encode(block_dict, self.binary)
+        head = BlockStore.REC_HEAD.pack(len(payload), zlib.crc32(payload), block_hash.encode())
+
+        if self.tail.tell() and self.tail.tell() + len(head) + len(payload) > self.seg_size:
+            self._rotate()
+
+        off = self.tail.tell()
+        self.tail.write(head + payload)
+        self.tail.flush()
+        os.fsync(self.tail.fileno())
+
+        self._add_index(block_hash, self.segs[-1], off + len(head), len(payload))
+        return True
+
+    def get_raw(self, block_hash):
+        loc = self.index.get(block_hash)
+        if loc is None:
+            return None
+
+        seg, off, length = loc
+        return self._map(seg, off + length)[off:off + length]
+
+    @staticmethod
+    def encode(block_dict, binary=True):
+        if binary:
+            try:
+                return Codec.encode(Codec.put_block, block_dict)
+            except CodecError:
+                pass
+        return json.dumps(block_dict, separators=(',', ':')).encode()
+
+    @staticmethod
+    def decode(raw):
+        # json records start with a brace, binary ones with codec version
+        if raw[0:1] == b'{':
+            return json.loads(raw)
+        return Codec.decode(Codec.get_block, raw)
+
+    @staticmethod
+    def decode_head(raw):
+        # block without pow, binary records stop parsing before the work
+        if raw[0:1] == b'{':
+            head = json.loads(raw)
+            del head['pow']
+            return head
+        return Codec.decode(Codec.get_block_head, raw, whole=False)
+
+    def get(self, block_hash):
+        raw = self.get_raw(block_hash)
+        return BlockStore.decode(raw) if raw is not None else None
+
+    def get_head(self, block_hash):
+        raw = self.get_raw(block_hash)
+        return BlockStore.decode_head(raw) if raw is not None else None
+
+    def get_hash(self, height):
+        try:
+            return self.heights[height]
+        except IndexError:
+            return None
+
+    def items(self):
+        for block_hash in self.heights:
+            yield block_hash, self.get(block_hash)
+
+    def heads(self):
+        for block_hash in self.heights:
+            yield block_hash, self.get_head(block_hash)
+
+    def import_chain(self, chain_dict):
+        return sum(self.append(h, b) for h, b in chain_dict['blocks'].items())
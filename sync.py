@@ -0,0 +1,336 @@
+import time
+import socket
+import asyncio
+
+from dacite import from_dict, DaciteError
+
+from wire import Wire, WireError
+from core import Block, BlockCheck
+from store import BlockStore
+
+
+class SyncError(Exception):
+    pass
+
+
+class SyncPeer:
+    def __init__(self, peer, timeout):
+        self.peer = peer
+        self.timeout = timeout
+        self.height = 0
+        self.caps = []
+        self.reader = None
+        self.writer = None
+        # sent a body not matching its hash, gets no more requests
+        self.bad = False
+
+    async def _open(self):
+        conn = asyncio.open_connection(self.peer.ipv6, self.peer.port, family=socket.AF_INET6)
+        self.reader, self.writer = await asyncio.wait_for(conn, self.timeout)
+
+    async def connect(self):
+        await self._open()
+
+        # binary replies are asked for in hello, peers without it drop the connection
+        try:
+            self.caps = Wire.peer_caps({'hello': await self.request(Wire.hello(), 'hello')})
+        except Sync.PEER_ERRORS:
+            self.close()
+            await self._open()
+
+    def name(self):
+        return f'[{self.peer.ipv6}]:{self.peer.port}'
+
+    async def request(self, data_dict, key):
+        self.writer.write(Wire.encode(data_dict))
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+        reply = await asyncio.wait_for(Wire.read(self.reader), self.timeout)
+        if key not in reply:
+            raise WireError('unexpected reply')
+        return reply[key]
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class Sync:
+    HASHES_MAX = 2000
+    BATCH = 16
+    # batches downloaded ahead of validation
+    WINDOW = 32
+    REPLY_MAX = 8 * 1024 * 1024
+    RETRIES = 3
+    TIMEOUT = 60
+    REPORT_EVERY = 5
+
+    # peer data failing deeper than decode
+    BLOCK_ERRORS = (ValueError, TypeError, KeyError, IndexError, AttributeError)
+    PEER_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, WireError, ValueError, KeyError, TypeError)
+
+    def __init__(self, chain, store, batch=None, window=None):
+        self.chain = chain
+        self.store = store
+        self.batch = batch or Sync.BATCH
+        self.window = window or Sync.WINDOW
+
+        self.pending = set()
+        self.failed = None
+        self.abort = None
+        self.slots = None
+        self.alive = 0
+        self.stats = {'blocks': 0, 'start': 0, 'report': 0}
+
+    # requests from other nodes
+    def get_hashes_hlr(self, req):
+        start = max(0, int(req['from']))
+        count = max(0, min(int(req.get('count', Sync.HASHES_MAX)), Sync.HASHES_MAX))
+
+        return {'hashes': {'from': start, 'height': len(self.store), 'hashes': self.store.heights[start:start + count]}}
+
+    def get_blocks_hlr(self, hashes):
+        blocks, size = [], 0
+
+        # reply stays under wire limit, requester asks again for the rest
+        for h in hashes[0:Sync.HASHES_MAX]:
+            raw = self.store.get_raw(h)
+            if raw is None or (blocks and size + len(raw) > Sync.REPLY_MAX):
+                break
+
+            blocks.append(BlockStore.decode(raw))
+            size += len(raw)
+
+        return {'blocks': blocks}
+
+    # download
+    def _fail(self, reason):
+        if self.failed is None:
+            self.failed = reason
+            self.abort.set_result(None)
+
+    async def _probe(self, peer, height):
+        conn = SyncPeer(peer, Sync.TIMEOUT)
+        try:
+            await conn.connect()
+            reply = await conn.request({'get_hashes': {'from': height, 'count': 0}}, 'hashes')
+            conn.height = int(reply['height'])
+            return conn
+        except Sync.PEER_ERRORS:
+            conn.close()
+            return None
+
+    async def _fetch_hashes(self, conn, start, target, work, order):
+        loop = asyncio.get_running_loop()
+
+        try:
+            while start < target and self.failed is None:
+                hashes = (await conn.request({'get_hashes': {'from': start, 'count': Sync.HASHES_MAX}}, 'hashes'))['hashes']
+                if not hashes:
+                    break
+
+                for i in range(0, len(hashes), self.batch):
+                    await self.slots.acquire()
+
+                    fut = loop.create_future()
+                    self.pending.add(fut)
+
+                    batch = hashes[i:i + self.batch]
+                    work.put_nowait([batch, {}, fut, 0])
+                    order.put_nowait((batch, fut))
+
+                start += len(hashes)
+        except Sync.PEER_ERRORS as e:
+            self._fail(f'hashes download failed: {str(e) or type(e).__name__}')
+        finally:
+            order.put_nowait(None)
+
+    def _leave(self, conn, work, item, reason):
+        print(f'Sync: peer {conn.name()} dropped: {reason}.')
+        conn.close()
+        work.put_nowait(item)
+
+        self.alive -= 1
+        if not self.alive:
+            self._fail('no peers left')
+
+    async def _download(self, conn, work):
+        while True:
+            item = await work.get()
+            batch, got, fut, tries = item
+
+            if fut.done():
+                continue
+            if conn.bad:
+                return self._leave(conn, work, item, 'bad block body')
+
+            try:
+                need = [h for h in batch if h not in got]
+                blocks = await conn.request({'get_blocks': need}, 'blocks')
+            except Sync.PEER_ERRORS as e:
+                return self._leave(conn, work, item, str(e) or type(e).__name__)
+
+            # bodies of a peer found bad while this request ran are not used
+            if conn.bad:
+                return self._leave(conn, work, item, 'bad block body')
+
+            # each body keeps its sender, a bad one is blamed on it
+            count = len(got)
+            for block_dict in blocks:
+                if isinstance(block_dict, dict) and block_dict.get('hash') in need:
+                    got[block_dict['hash']] = (block_dict, conn)
+
+            if len(got) == len(batch):
+                fut.set_result([got[h] for h in batch])
+                self.pending.discard(fut)
+                continue
+
+            # partial replies are progress, empty ones count as failed attempts
+            item[3] = tries + int(len(got) == count)
+            if item[3] >= Sync.RETRIES:
+                self._fail(f'block {need[0][0:12]} not found on peers')
+            else:
+                work.put_nowait(item)
+
+    def _decode(self, block_hash, block_dict):
+        # body not matching its hash is the sender's fault, another peer may have the right one
+        try:
+            block = from_dict(Block, block_dict)
+            if block.hash != block_hash or not block.dict_verify():
+                return None, 'hash mismatch'
+        except (DaciteError, ValueError, TypeError, KeyError, AttributeError) as e:
+            return None, f'malformed: {str(e)}'
+        return block, None
+
+    def _report(self, target, force=False):
+        now = time.monotonic()
+        if not force and now - self.stats['report'] < Sync.REPORT_EVERY:
+            return
+
+        self.stats['report'] = now
+        rate = self.stats['blocks'] / max(now - self.stats['start'], 1e-9)
+        print(f'Sync: {self.chain.blocks_count()}/{target} blocks, {rate:.1f} blocks/s.')
+
+    async def _wait(self, fut):
+        await asyncio.wait([fut, self.abort], return_when=asyncio.FIRST_COMPLETED)
+        if not fut.done():
+            raise SyncError(self.failed)
+        return fut.result()
+
+    async def _validate(self, order, work, accept, target):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            item = await order.get()
+            if item is None:
+                return
+
+            batch, fut = item
+            bodies = await self._wait(fut)
+            self.slots.release()
+
+            # bad body drops its sender, rest of the batch is asked from remaining peers
+            while batch:
+                bad = await self._import(batch, bodies, accept, target)
+                if bad is None:
+                    break
+
+                i, conn, reason = bad
+                print(f'Sync: block {batch[i][0:12]} from peer {conn.name()} {reason}.')
+                conn.bad = True
+
+                batch = batch[i:]
+                fut = loop.create_future()
+                self.pending.add(fut)
+                work.put_nowait([batch, {}, fut, 0])
+                bodies = await self._wait(fut)
+
+    async def _import(self, batch, bodies, accept, target):
+        # index, sender and reason of first bad body, None when the whole batch is imported
+        for i, (block_hash, (block_dict, conn)) in enumerate(zip(batch, bodies)):
+            if block_hash in self.chain.blocks:
+                continue
+
+            block, reason = self._decode(block_hash, block_dict)
+            if block is None:
+                return i, conn, reason
+
+            # body matches its hash, so every peer has the same block, failures below abort sync
+            # only pow check runs off the loop, next batches keep downloading
+            try:
+                work_ok = await self.chain.work_check_async(block)
+            except Sync.BLOCK_ERRORS as e:
+                raise SyncError(f'block {block_hash[0:12]} malformed: {str(e)}')
+            if not work_ok:
+                raise SyncError(f'block {block_hash[0:12]} rejected: {str(BlockCheck.POW_FAILED)}')
+
+            # gossip may have accepted it meanwhile, chain state is checked right before import
+            if block_hash in self.chain.blocks:
+                continue
+
+            try:
+                reason = self.chain.check_block(block, work_checked=True)
+            except Sync.BLOCK_ERRORS as e:
+                raise SyncError(f'block {block_hash[0:12]} malformed: {str(e)}')
+            if reason is not BlockCheck.OK:
+                raise SyncError(f'block {block_hash[0:12]} rejected: {str(reason)}')
+
+            self.chain.import_block(block_hash, block)
+            await accept(block)
+
+            self.stats['blocks'] += 1
+            self._report(target)
+
+    async def run(self, peers, accept):
+        # local store height is where previous sync stopped
+        height = self.chain.blocks_count()
+
+        conns = [c for c in await asyncio.gather(*[self._probe(p, height) for p in peers]) if c is not None]
+        target = max([c.height for c in conns], default=0)
+
+        if target <= height:
+            print(f'Sync: chain is up to date, {height} blocks.')
+            for conn in conns:
+                conn.close()
+            return 0
+
+        # any peer ahead of us serves bodies, the highest one serves hashes
+        conns = [c for c in conns if c.height > height]
+        best = max(conns, key=lambda c: c.height)
+        print(f'Sync: {height} -> {target} blocks from {len(conns)} peers.')
+
+        self.pending, self.failed = set(), None
+        self.abort = asyncio.get_running_loop().create_future()
+        self.slots = asyncio.Semaphore(self.window)
+        self.alive = len(conns)
+        self.stats = {'blocks': 0, 'start': time.monotonic(), 'report': time.monotonic()}
+
+        work, order = asyncio.Queue(), asyncio.Queue()
+
+        # hashes connection is separate so header requests never wait behind bodies
+        hashes_conn = await self._probe(best.peer, height)
+        if hashes_conn is None:
+            for conn in conns:
+                conn.close()
+            print(f'Sync: failed: peer [{best.peer.ipv6}]:{best.peer.port} unavailable.')
+            return 0
+
+        fetcher = asyncio.ensure_future(self._fetch_hashes(hashes_conn, height, target, work, order))
+        workers = [asyncio.ensure_future(self._download(conn, work)) for conn in conns]
+
+        try:
+            await self._validate(order, work, accept, target)
+            if self.failed:
+                raise SyncError(self.failed)
+            print('Sync: done.')
+        except SyncError as e:
+            print(f'Sync: failed: {str(e)}.')
+        finally:
+            for task in [fetcher, *workers, *self.pending]:
+                task.cancel()
+            for conn in [hashes_conn, *conns]:
+                conn.close()
+
+        self._report(target, force=True)
+        return self.stats['blocks']
@@ -0,0 +1,236 @@
+import zlib
+import json
+import struct
+
+from codec import Codec, CodecError
+
+
+class WireError(Exception):
+    pass
+
+
+class Wire:
+    # frame: magic | version | type | flags | payload length | payload
+    HEAD = struct.Struct('>2sBBBI')
+    MAGIC = b'PC'
+    VER = 1
+
+    FLAG_ZLIB = 0x01
+    FLAG_BIN = 0x02
+
+    # capabilities announced in hello
+    CAP_BIN = 'bin1'
+    # blocks are announced by hash, payload is sent on get_data
+    CAP_INV = 'inv1'
+    CAPS = [CAP_BIN, CAP_INV]
+
+    MSG_DICT = 0
+    MSG_PEERS = 1
+    MSG_BLOCK = 2
+    MSG_TRANS = 3
+    MSG_GET_HASHES = 4
+    MSG_HASHES = 5
+    MSG_GET_BLOCKS = 6
+    MSG_BLOCKS = 7
+    MSG_HELLO = 8
+    MSG_INV = 9
+    MSG_GET_DATA = 10
+
+    MSG_KEYS = {
+        'peers': MSG_PEERS,
+        'block': MSG_BLOCK,
+        'trans': MSG_TRANS,
+        'get_hashes': MSG_GET_HASHES,
+        'hashes': MSG_HASHES,
+        'get_blocks': MSG_GET_BLOCKS,
+        'blocks': MSG_BLOCKS,
+        'hello': MSG_HELLO,
+        'inv': MSG_INV,
+        'get_data': MSG_GET_DATA
+    }
+    MSG_NAMES = {v: k for k, v in MSG_KEYS.items()}
+
+    # message types with compact binary form
+    CODECS = {
+        MSG_PEERS: (Codec.put_peers, Codec.get_peers),
+        MSG_BLOCK: (Codec.put_block, Codec.get_block),
+        MSG_TRANS: (Codec.put_trans, Codec.get_trans),
+        MSG_BLOCKS: (Codec.put_blocks, Codec.get_blocks)
+    }
+
+    # max decompressed payload per message type
+    MAX_SIZE = {
+        MSG_DICT: 1024 * 1024,
+        MSG_PEERS: 1024 * 1024,
+        MSG_BLOCK: 16 * 1024 * 1024,
+        MSG_TRANS: 64 * 1024,
+        MSG_GET_HASHES: 1024,
+        MSG_HASHES: 1024 * 1024,
+        MSG_GET_BLOCKS: 64 * 1024,
+        MSG_BLOCKS: 32 * 1024 * 1024,
+        MSG_HELLO: 1024,
+        MSG_INV: 256 * 1024,
+        MSG_GET_DATA: 256 * 1024
+    }
+
+    COMPRESS_MIN = 256
+    CHUNK = 64 * 1024
+
+    # legacy unframed messages start with zlib header byte
+    LEGACY_MARK = 0x78
+
+    @staticmethod
+    def msg_type(data_dict):
+        keys = list(data_dict.keys())
+        return Wire.MSG_KEYS.get(keys[0], Wire.MSG_DICT) if len(keys) == 1 else Wire.MSG_DICT
+
+    @staticmethod
+    def hello():
+        return {'hello': {'ver': Wire.VER, 'caps': Wire.CAPS}}
+
+    @staticmethod
+    def peer_caps(data):
+        caps = data.get('hello', {}).get('caps', [])
+        return [c for c in Wire.CAPS if isinstance(caps, list) and c in caps]
+
+    @staticmethod
+    def encode_legacy(data_dict):
+        # unframed zlib json, one message per connection, for peers that never answered hello
+        return zlib.compress(json.dumps(data_dict).encode())
+
+    @staticmethod
+    def _encode_bin(msg_type, data_dict):
+        put = Wire.CODECS[msg_type][0]
+        try:
+            return Codec.encode(put, next(iter(data_dict.values())))
+        except CodecError:
+            # values codec can not reproduce exactly go as json
+            return None
+
+    @staticmethod
+    def encode(data_dict, binary=False):
+        msg_type = Wire.msg_type(data_dict)
+
+        flags, payload = 0, None
+        if binary and msg_type in Wire.CODECS:
+            payload = Wire._encode_bin(msg_type, data_dict)
+            flags |= Wire.FLAG_BIN if payload is not None else 0
+
+        if payload is None:
+            payload = json.dumps(data_dict).encode()
+
+        if len(payload) >= Wire.COMPRESS_MIN:
+            payload = zlib.compress(payload)
+            flags |= Wire.FLAG_ZLIB
+
+        head = Wire.HEAD.pack(Wire.MAGIC, Wire.VER, msg_type, flags, len(payload))
+        return head + payload
+
+    @staticmethod
+    async def _read_payload(reader, length, zipped, max_size):
+        # stream compressed input through decompressor so output size is bounded
+        dec = zlib.decompressobj() if zipped else None
+        parts, size = [], 0
+
+        while length:
+            chunk = await reader.readexactly(min(length, Wire.CHUNK))
+            length -= len(chunk)
+
+            if dec is not None:
+                chunk = dec.decompress(chunk, max_size - size + 1)
+                if dec.unconsumed_tail:
+                    raise WireError('payload too large')
+
+            size += len(chunk)
+            if size > max_size:
+                raise WireError('payload too large')
+            parts.append(chunk)
+
+        if dec is not None and not dec.eof:
+            raise WireError('truncated zlib stream')
+        return b''.join(parts)
+
+    @staticmethod
+    async def read_legacy(reader, head):
+        dec = zlib.decompressobj()
+        max_size = Wire.MAX_SIZE[Wire.MSG_BLOCK]
+        parts, size = [], 0
+
+        chunk, trailing = head, 0
+        while chunk:
+            # bytes after end of stream are not kept, sender gets the same limit for them
+            if dec.eof:
+                trailing += len(chunk)
+                if trailing > max_size:
+                    raise WireError('payload too large')
+                chunk = await reader.read(Wire.CHUNK)
+                continue
+
+            out = dec.decompress(chunk, max_size - size + 1)
+            size += len(out)
+            if size > max_size or dec.unconsumed_tail:
+                raise WireError('payload too large')
+            parts.append(out)
+            chunk = await reader.read(Wire.CHUNK)
+
+        return json.loads(b''.join(parts))
+
+    @staticmethod
+    async def read(reader, head=None):
+        head = head or await reader.readexactly(Wire.HEAD.size)
+        magic, ver, msg_type, flags, length = Wire.HEAD.unpack(head)
+
+        if magic != Wire.MAGIC or ver != Wire.VER:
+            raise WireError('bad frame header')
+
+        max_size = Wire.MAX_SIZE.get(msg_type)
+        if max_size is None:
+            raise WireError(f'unknown message type {msg_type}')
+
+        # valid zlib stream is never much larger than its output
+        zipped = bool(flags & Wire.FLAG_ZLIB)
+        if length > max_size + (Wire.COMPRESS_MIN if zipped else 0):
+            raise WireError('payload too large')
+
+        payload = await Wire._read_payload(reader, length, zipped, max_size)
+
+        if flags & Wire.FLAG_BIN:
+            if msg_type not in Wire.CODECS:
+                raise WireError(f'no binary form for message type {msg_type}')
+            try:
+                return {Wire.MSG_NAMES[msg_type]: Codec.decode(Wire.CODECS[msg_type][1], payload)}
+            except CodecError as e:
+                raise WireError(f'bad binary payload: {str(e)}')
+
+        data = json.loads(payload)
+        if not isinstance(data, dict) or Wire.msg_type(data) != msg_type:
+            raise WireError('message type mismatch')
+        return data
+
+
+class WireMsg:
+    # one message to many peers, encoded once per format
+    def __init__(self, data_dict, legacy=None):
+        self.data = data_dict
+        # sent instead to peers without inventory gossip
+        self.legacy = legacy
+        self.frames = {}
+
+    def frame(self, binary=False, legacy=False):
+        key = (binary, legacy and self.legacy is not None)
+        if key not in self.frames:
+            self.frames[key] = Wire.encode(self.legacy if key[1] else self.data, binary)
+        return self.frames[key]
+
+    def frame_for(self, caps):
+        return self.frame(Wire.CAP_BIN in caps, Wire.CAP_INV not in caps)
+
+    def legacy_frame(self):
+        key = 'legacy'
+        if key not in self.frames:
+            self.frames[key] = Wire.encode_legacy(self.legacy if self.legacy is not None else self.data)
+        return self.frames[key]
+
+    def name(self, legacy=False):
+        data = self.legacy if legacy and self.legacy is not None else self.data
+        return Wire.MSG_NAMES.get(Wire.msg_type(data), 'dict')